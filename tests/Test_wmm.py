@@ -1,7 +1,15 @@
 import os.path
+import json
+import sys
+import warnings
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
 import unittest
 import numpy as np
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 
 
 from geomaglib import util, sh_loader
@@ -10,6 +18,9 @@ from wmm import load, utils
 from wmm import wmm_calc
 from wmm.build import fill_timeslot
 
+# A generous budget in microseconds for the cumulative time of "import wmm", which only takes about 1 ms while numpy
+# and geomaglib are imported on first use
+IMPORT_TIME_BUDGET_US = 200000
 
 
 class Test_wmm(unittest.TestCase):
@@ -73,6 +84,36 @@ class Test_wmm(unittest.TestCase):
                 self.dBh.append(dh)
                 self.dBf.append(df)
 
+    def test_import_time(self):
+
+        env = dict(os.environ, PYTHONPATH=self.top_dir)
+
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import wmm"], env=env,
+                              capture_output=True, text=True, check=True)
+        import_time = None
+        for line in proc.stderr.splitlines():
+            vals = line.split("|")
+            if len(vals) == 3 and vals[2].strip() == "wmm":
+                import_time = int(vals[1])
+
+        self.assertIsNotNone(import_time)
+        self.assertLess(import_time, IMPORT_TIME_BUDGET_US)
+
+        # "import wmm" is fast as long as the heavy modules are only imported on first use
+        modules = ["numpy", "geomaglib", "wmm.build"]
+
+        proc = subprocess.run([sys.executable, "-c", f"import sys, wmm; print(*[name in sys.modules for name in {modules}])"],
+                              env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(proc.stdout.split(), ["False"] * len(modules))
+
+        proc = subprocess.run([sys.executable, "-c", f"import sys, wmm; wmm.wmm_calc; print(*[name in sys.modules for name in {modules}])"],
+                              env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(proc.stdout.split(), ["True"] * len(modules))
+
+        import wmm
+        for name in wmm._lazy_submodules:
+            self.assertEqual(getattr(wmm, name).__name__, f"wmm.{name}")
+
     def test_load_wmmcoeff(self):
 
         nmax = 12
@@ -84,6 +125,87 @@ class Test_wmm(unittest.TestCase):
         self.assertAlmostEqual(coef["min_year"][0], 2024.866, delta=1e-3)
         self.assertEqual(len(coef["g"]), num_elems + 1)
 
+    def test_load_wmmcoeff_cached(self):
+
+        load.clear_cache()
+
+        coef = load.load_wmm_coefs_cached(self.wmm_file, 12)
+        self.assertIs(load.load_wmm_coefs_cached(self.wmm_file, 12)["g"], coef["g"])
+        self.assertIsNot(load.load_wmm_coefs_cached(self.wmm_file, 10)["g"], coef["g"])
+        np.testing.assert_array_equal(coef["g"], load.load_wmm_coefs(self.wmm_file, 12)["g"])
+
+        with self.assertRaises(ValueError):
+            coef["g"][1] = 0.0
+
+        model1, model2 = wmm_calc(), wmm_calc()
+        model1.setup_time(dyear=2026.0)
+        model2.setup_time(dyear=2027.0)
+        self.assertIs(model1.coef_dict["g_sv"], model2.coef_dict["g_sv"])
+
+        cache_size = load.COEF_CACHE_SIZE
+        load.COEF_CACHE_SIZE = 4
+        try:
+            for nmax in range(1, 13):
+                load.load_wmm_coefs_cached(self.wmm_file, nmax)
+            self.assertEqual(len(load._coef_cache), 4)
+        finally:
+            load.COEF_CACHE_SIZE = cache_size
+
+        load.clear_cache()
+        self.assertEqual(len(load._coef_cache), 0)
+        self.assertIsNot(load.load_wmm_coefs_cached(self.wmm_file, 12)["g"], coef["g"])
+
+    def test_load_wmmcoeff_binary(self):
+
+        # the packaged binary file should be regenerated by python -m wmm.compile_coefs whenever WMM.COF changes
+        for nmax in [1, 6, 12]:
+            coef = load.load_wmm_coefs(self.wmm_file, nmax)
+            coef_bin = load.load_wmm_coefs_binary(self.wmm_file, nmax)
+            self.assertIsNotNone(coef_bin)
+
+            for key in coef:
+                if isinstance(coef[key], np.ndarray):
+                    np.testing.assert_array_equal(coef_bin[key], coef[key])
+                else:
+                    self.assertEqual(coef_bin[key], coef[key])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cof_file = os.path.join(tmp_dir, "WMM.COF")
+            shutil.copy(self.wmm_file, cof_file)
+            self.assertIsNone(load.load_wmm_coefs_binary(cof_file, 12))
+
+            bin_file = load.write_wmm_coefs_binary(cof_file)
+            self.assertEqual(bin_file, os.path.join(tmp_dir, "WMM.bin"))
+            self.assertIsNotNone(load.load_wmm_coefs_binary(cof_file, 12))
+
+            # the binary file is ignored once the text file is changed
+            with open(cof_file, "a") as fp:
+                fp.write("\n")
+            self.assertIsNone(load.load_wmm_coefs_binary(cof_file, 12))
+
+    def test_timely_modify_magnetic_model(self):
+
+        coef = load.load_wmm_coefs(self.wmm_file, 12)
+        dyears = np.array([2025.5, 2026.6, 2029.1])
+
+        timly_coef = load.timely_modify_magnetic_model(coef, dyears, 12)
+        self.assertEqual(timly_coef["g"].shape, (len(coef["g"]), len(dyears)))
+        self.assertEqual(timly_coef["epoch"], coef["epoch"])
+
+        for n in range(1, 13):
+            for m in range(n + 1):
+                index = n * (n + 1) // 2 + m
+                for i in range(len(dyears)):
+                    dt = dyears[i] - coef["epoch"]
+                    self.assertEqual(timly_coef["g"][index][i], coef["g"][index] + dt * coef["g_sv"][index])
+                    self.assertEqual(timly_coef["h"][index][i], coef["h"][index] + dt * coef["h_sv"][index])
+
+        timly_coef = load.timely_modify_magnetic_model(coef, np.array([2027.0]), 12)
+        self.assertEqual(timly_coef["g"].shape, coef["g"].shape)
+        self.assertEqual(timly_coef["g"][1], coef["g"][1] + 2.0 * coef["g_sv"][1])
+        # the loaded coefficients are not modified
+        self.assertEqual(coef["g"][1], -29351.8)
+
     def test_setup_max_degree(self):
 
 
@@ -315,6 +437,97 @@ class Test_wmm(unittest.TestCase):
             self.assertAlmostEqual(dBy[i], self.dBy[i], delta=tol)
             self.assertAlmostEqual(dBz[i], self.dBz[i], delta=tol)
 
+    def test_forward_all(self):
+
+        wmm_model = wmm_calc()
+
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        Bx, By, Bz, dBx, dBy, dBz = wmm_model.forward_all()
+        base = wmm_model.forward_base()
+        sv = wmm_model.forward_sv()
+
+        for fused, single in zip((Bx, By, Bz, dBx, dBy, dBz), base + sv):
+            np.testing.assert_allclose(fused, single, rtol=1e-12, atol=1e-9)
+
+    def test_results_cache(self):
+
+        wmm_model = wmm_calc()
+
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        Bx = wmm_model.get_Bx()
+        wmm_model.get_By()
+        wmm_model.get_Bdec()
+        wmm_model.get_Bh()
+        self.assertEqual(wmm_model.cache_stats["misses"], 1)
+        self.assertGreaterEqual(wmm_model.cache_stats["hits"], 3)
+
+        # the same coordinates and time won't invalidate the cache
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        wmm_model.setup_time(dyear=self.dyears)
+        np.testing.assert_array_equal(wmm_model.get_Bx(), Bx)
+        self.assertEqual(wmm_model.cache_stats["misses"], 1)
+
+        wmm_model.setup_time(dyear=np.array(self.dyears) + 0.5)
+        self.assertFalse(np.array_equal(wmm_model.get_Bx(), Bx))
+
+        Bx = wmm_model.get_Bx()
+        wmm_model.setup_env(np.array(self.lats) * 0.5, self.lons, self.alts, msl=False)
+        self.assertFalse(np.array_equal(wmm_model.get_Bx(), Bx))
+
+        mag_map = wmm_model.get_all()
+        for key, val in wmm_model.get_all().items():
+            np.testing.assert_array_equal(val, mag_map[key])
+
+    def test_writable_results(self):
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        expected = {key: val.copy() for key, val in wmm_model.get_all().items()}
+
+        # the results can be modified by the callers without changing the cache
+        mag_map = wmm_model.get_all()
+        for key in mag_map:
+            mag_map[key] *= 1e-9
+        mag_map = wmm_model.get_elements(["x", "dz"])
+        mag_map["x"] += 1.0
+        mag_map["dz"][0] = 0.0
+        Bx = wmm_model.get_Bx()
+        Bx *= 2.0
+        dBx, dBy, dBz = wmm_model.forward_sv()
+        dBz[:] = 0.0
+
+        for key, val in wmm_model.get_all().items():
+            np.testing.assert_array_equal(val, expected[key])
+        np.testing.assert_array_equal(wmm_model.get_Bx(), expected["x"])
+        np.testing.assert_array_equal(wmm_model.get_dBz(), expected["dz"])
+
+    def test_getters_match_get_all(self):
+
+        def new_model():
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=2026.5)
+            wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+            return wmm_model
+
+        expected = new_model().get_all()
+
+        # the main field is summed up the same way with or without the secular variation
+        wmm_model = new_model()
+        getters = {"x": wmm_model.get_Bx, "y": wmm_model.get_By, "z": wmm_model.get_Bz, "h": wmm_model.get_Bh,
+                   "f": wmm_model.get_Bf, "dec": wmm_model.get_Bdec, "inc": wmm_model.get_Binc}
+        for key, getter in getters.items():
+            self.assertEqual(getter().tolist(), expected[key].tolist())
+        self.assertEqual(wmm_model.get_all()["x"].tolist(), expected["x"].tolist())
+
+        self.assertEqual(new_model().get_elements(["dec"])["dec"].tolist(), expected["dec"].tolist())
+        self.assertEqual(new_model().get_elements(["dec"], chunk_size=5)["dec"].tolist(), expected["dec"].tolist())
+
     def test_get_dBh(self):
 
 
@@ -373,6 +586,784 @@ class Test_wmm(unittest.TestCase):
             self.assertAlmostEqual(map["ddec"][i] , self.dBdec[i], delta=0.05)
             self.assertAlmostEqual(map["dinc"][i] , self.dBinc[i], delta=0.05)
 
+    def test_get_all_chunked(self):
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        expected = wmm_model.get_all()
+
+        for chunk_args in [{"chunk_size": 7}, {"chunk_size": 1000}, {"max_memory_mb": 0.01}]:
+            mag_map = wmm_model.get_all(**chunk_args)
+
+            self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+            for key in expected:
+                np.testing.assert_allclose(mag_map[key], expected[key], rtol=1e-12, atol=1e-9)
+
+        self.assertLess(wmm_model.get_chunk_size(0.01), len(self.lats))
+        self.assertGreater(wmm_model.get_chunk_size(100), len(self.lats))
+
+        with self.assertRaises(ValueError):
+            wmm_model.get_all(chunk_size=0)
+
+    def test_get_all_workers(self):
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        expected = wmm_model.get_all(chunk_size=3)
+
+        for worker_args in [{"chunk_size": 3, "workers": 4}, {"workers": 3}]:
+            mag_map = wmm_model.get_all(**worker_args)
+
+            self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+            for key in expected:
+                np.testing.assert_array_equal(mag_map[key], expected[key])
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            wmm_model.executor = executor
+            mag_map = wmm_model.get_elements(["dec", "inc"], chunk_size=3)
+        wmm_model.executor = None
+
+        np.testing.assert_array_equal(mag_map["dec"], expected["dec"])
+        np.testing.assert_array_equal(mag_map["inc"], expected["inc"])
+
+        with self.assertRaises(ValueError):
+            wmm_model.get_all(workers=0)
+
+    def test_get_elements(self):
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        mag_map = wmm_model.get_elements(["dec", "h"])
+        self.assertEqual(list(mag_map.keys()), ["h", "dec"])
+
+        # the secular variation is not computed for base elements at one date
+        scalar_model = wmm_calc()
+        scalar_model.setup_time(dyear=2026.0)
+        scalar_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        scalar_model.get_elements(["dec"])
+        self.assertEqual(list(scalar_model.results.keys()), ["base", "elements"])
+
+        expected = wmm_model.get_all()
+        for elements in [["dec"], ["inc", "x"], ["dinc", "ddec"], list(expected.keys())]:
+            mag_map = wmm_model.get_elements(elements)
+            self.assertEqual(sorted(mag_map.keys()), sorted(elements))
+            for key in elements:
+                np.testing.assert_allclose(mag_map[key], expected[key], rtol=1e-12, atol=1e-9)
+
+        mag_map = wmm_model.get_elements(["dec", "df"], chunk_size=4)
+        for key in mag_map:
+            np.testing.assert_allclose(mag_map[key], expected[key], rtol=1e-12, atol=1e-9)
+
+        with self.assertRaises(ValueError):
+            wmm_model.get_elements(["declination"])
+
+    def test_grid(self):
+
+        lats = np.linspace(-90, 90, 7)
+        lons = np.linspace(-180, 180, 9)
+        alts = np.array([0.0, 100.0])
+        dyear = 2026.3
+
+        wmm_model = wmm_calc()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_grid = wmm_model.grid(lats, lons, alts, dyear=dyear)
+
+            lat_grid, lon_grid, alt_grid = np.meshgrid(lats, lons, alts, indexing="ij")
+            point_model = wmm_calc()
+            point_model.setup_time(dyear=dyear)
+            point_model.setup_env(lat_grid.ravel(), lon_grid.ravel(), alt_grid.ravel())
+            expected = point_model.get_all()
+
+            dec_grid = wmm_model.grid(lats, lons, 0.0, elements=["dec"])
+
+        self.assertEqual(list(mag_grid.keys()), list(expected.keys()))
+        for key in expected:
+            self.assertEqual(mag_grid[key].shape, (7, 9, 2))
+            np.testing.assert_allclose(mag_grid[key].ravel(), expected[key], rtol=1e-9, atol=1e-9)
+
+        self.assertEqual(list(dec_grid.keys()), ["dec"])
+        np.testing.assert_allclose(dec_grid["dec"], mag_grid["dec"][:, :, 0], rtol=1e-12)
+
+        with self.assertRaises(ValueError):
+            wmm_model.grid(lats, lons, alts, dyear=[2026.0, 2027.0])
+
+    def test_mixed_dates(self):
+
+        dyears = np.linspace(2025.0, 2029.9, len(self.lats))
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        wmm_model.setup_time(dyear=dyears)
+        # the coefficients of every date are only computed on access
+        self.assertIsNone(wmm_model._timly_coef_dict)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = wmm_model.get_all()
+            chunk_map = wmm_model.get_all(chunk_size=5)
+
+            for i in range(len(self.lats)):
+                point_model = wmm_calc()
+                point_model.setup_env(self.lats[i], self.lons[i], self.alts[i], msl=False)
+                point_model.setup_time(dyear=dyears[i])
+                expected = point_model.get_all()
+
+                for key in expected:
+                    self.assertAlmostEqual(mag_map[key][i], expected[key][0], delta=1e-8)
+                    self.assertAlmostEqual(chunk_map[key][i], expected[key][0], delta=1e-8)
+
+        for key in ("g", "h"):
+            self.assertEqual(np.shape(wmm_model.timly_coef_dict[key]), (len(point_model.timly_coef_dict[key]), len(dyears)))
+            np.testing.assert_array_equal(wmm_model.timly_coef_dict[key][:, -1], point_model.timly_coef_dict[key])
+
+        # the field at epoch is reused for new dates
+        misses = wmm_model.cache_stats["misses"]
+        wmm_model.setup_time(dyear=dyears[::-1])
+        wmm_model.get_all()
+        self.assertEqual(wmm_model.cache_stats["misses"], misses)
+
+    def test_setup_env_dyear(self):
+
+        dyears = np.linspace(2025.0, 2029.9, len(self.lats))
+        expected = wmm_calc()
+        expected.setup_time(dyear=dyears)
+        expected.setup_env(self.lats, self.lons, self.alts, msl=False)
+        expected = expected.get_all()
+
+        # the batches of different lengths are set up with their own dates
+        wmm_model = wmm_calc()
+        for start, stop in ((0, 5), (5, 7), (7, 8), (8, len(self.lats))):
+            wmm_model.setup_env(self.lats[start:stop], self.lons[start:stop], self.alts[start:stop], msl=False,
+                                dyear=dyears[start:stop])
+            mag_map = wmm_model.get_all()
+            for key in expected:
+                np.testing.assert_allclose(mag_map[key], expected[key][start:stop], rtol=1e-12, atol=1e-9)
+
+        # the scalar coordinates are broadcast to the dates
+        wmm_model.setup_env(self.lats[0], self.lons[0], self.alts[0], msl=False, dyear=dyears[:3])
+        self.assertEqual(wmm_model.lat.size, 3)
+
+        with self.assertRaises(ValueError):
+            wmm_model.setup_env(self.lats[:4], self.lons[:4], self.alts[:4], msl=False, dyear=dyears[:3])
+        # setup_time() still checks the time with the previous coordinates
+        with self.assertRaises(ValueError):
+            wmm_model.setup_time(dyear=dyears[:5])
+
+    def test_time_sweep(self):
+
+        dyears = np.linspace(2025.0, 2029.9, 11)
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = wmm_model.time_sweep(dyears)
+
+            for i in [0, 4, 10]:
+                point_model = wmm_calc()
+                point_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+                point_model.setup_time(dyear=dyears[i])
+                expected = point_model.get_all()
+
+                for key in expected:
+                    self.assertEqual(mag_map[key].shape, (len(self.lats), len(dyears)))
+                    np.testing.assert_allclose(mag_map[key][:, i], expected[key], rtol=1e-9, atol=1e-9)
+
+        self.assertEqual(list(wmm_model.time_sweep(dyears, elements=["dec"]).keys()), ["dec"])
+
+        with self.assertRaises(ValueError):
+            wmm_model.time_sweep([2026.0, 2031.0])
+
+    def test_evaluate(self):
+        import wmm
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        expected = wmm_model.get_all()
+        mag_map = wmm.evaluate(self.lats, self.lons, self.alts, self.dyears)
+
+        self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+        for key in expected:
+            np.testing.assert_array_equal(mag_map[key], expected[key])
+
+        self.assertEqual(list(wmm.evaluate(0, 0, 0, 2026.0, elements=["inc", "dec"]).keys()), ["dec", "inc"])
+
+        with self.assertRaises(ValueError):
+            wmm.evaluate(self.lats, self.lons, self.alts, 2031.0)
+        with self.assertRaises(ValueError):
+            wmm.evaluate([0, 1, 2], [0, 1], 0, 2026.0)
+
+        # the entry points share the checks of the elements and the sizes
+        from wmm.build import check_elements, broadcast_points
+        self.assertEqual(check_elements(["inc", "dec"]), ("dec", "inc"))
+        for func in (wmm.evaluate, wmm.wmm_cache().evaluate):
+            with self.assertRaisesRegex(ValueError, "unknown magnetic elements"):
+                func(0, 0, 0, 2026.0, elements=["decl"])
+            with self.assertRaisesRegex(ValueError, "different sizes"):
+                func([0, 1, 2], [0, 1], 0, 2026.0)
+        with self.assertRaisesRegex(ValueError, "different sizes"):
+            broadcast_points([0, 1, 2], [0, 1], 0)
+        with self.assertRaisesRegex(ValueError, "empty"):
+            wmm.evaluate([], [], [], [])
+        with self.assertRaises(TypeError):
+            wmm.evaluate(0, 0, 0, 2026.0, nmax=12.0)
+        with self.assertRaises(ValueError):
+            wmm.evaluate(0, 0, 0, 2026.0, nmax=13)
+
+        # the altitude and blackout zone warnings can be skipped without changing the warning filters
+        for warn in (True, False):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                mag_map = wmm.evaluate([0, 85.0], [0, 140.0], 2000.0, 2026.0, warn=warn)
+            self.assertEqual(len(caught) > 0, warn)
+            np.testing.assert_array_equal(mag_map["f"], wmm.evaluate([0, 85.0], [0, 140.0], 2000.0, 2026.0, warn=False)["f"])
+
+    def test_evaluate_concurrent(self):
+        import wmm
+
+        rng = np.random.default_rng(0)
+        num_callers = 8
+        inputs = [(rng.uniform(-80, 80, 50), rng.uniform(-180, 180, 50), rng.uniform(0, 100, 50),
+                   rng.uniform(2025, 2029.9, 50) if i % 2 else 2025.0 + i / 2) for i in range(num_callers)]
+
+        def call(i):
+            for _ in range(20):
+                mag_map = wmm.evaluate(*inputs[i])
+                for key in expected[i]:
+                    np.testing.assert_array_equal(mag_map[key], expected[i][key])
+            return i
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = [wmm.evaluate(*args) for args in inputs]
+
+            with ThreadPoolExecutor(max_workers=num_callers) as executor:
+                futures = [executor.submit(call, i % num_callers) for i in range(4 * num_callers)]
+                for future in futures:
+                    future.result()
+
+    def test_aevaluate(self):
+        import asyncio
+        import wmm
+        from wmm import aio
+
+        rng = np.random.default_rng(0)
+        lats, lons = rng.uniform(-80, 80, 50), rng.uniform(-180, 180, 50)
+
+        async def run():
+            calls = [wmm.aevaluate(lat, lon, 10.0, 2026.0, elements=["dec"]) for lat, lon in zip(lats, lons)]
+            calls.append(wmm.aevaluate(0.0, 0.0, 0.0, 2031.0))
+            calls.append(wmm.aevaluate(lats, lons, 10.0, 2026.0, elements=["dec"]))
+            results = await asyncio.gather(*calls, return_exceptions=True)
+            coalescer = aio.get_coalescer(None, 12, "km", False)
+            # the batches are kept until they finish
+            await asyncio.gather(*coalescer.tasks)
+            self.assertEqual(coalescer.tasks, set())
+
+            # the invalid settings fail before the call joins a batch
+            with self.assertRaises(ValueError):
+                await wmm.aevaluate(0.0, 0.0, 0.0, 2026.0, nmax=13)
+            with self.assertRaises(ValueError):
+                await wmm.aevaluate(0.0, 0.0, 0.0, 2026.0, elements=["decl"])
+            self.assertNotIn(13, [key[1] for key in aio._coalescers[asyncio.get_running_loop()]])
+            return results, coalescer.stats
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            results, stats = asyncio.run(run())
+            expected = wmm.evaluate(lats, lons, 10.0, 2026.0, elements=["dec"])
+
+        np.testing.assert_array_equal(np.concatenate([res["dec"] for res in results[:50]]), expected["dec"])
+        self.assertIsInstance(results[50], ValueError)
+        np.testing.assert_array_equal(results[51]["dec"], expected["dec"])
+
+        self.assertEqual(stats["calls"], 51)
+        self.assertLess(stats["batches"], 5)
+
+    def test_serve(self):
+        import json
+        import threading
+        import urllib.request
+        import urllib.error
+        import wmm
+        from wmm.serve import WMMServer
+
+        server = WMMServer(("127.0.0.1", 0), max_batch=64, max_wait=0.01)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def post(query):
+            request = urllib.request.Request(url + "/evaluate", data=json.dumps(query).encode("utf-8"))
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, json.loads(response.read())
+            except urllib.error.HTTPError as err:
+                return err.code, json.loads(err.read())
+
+        try:
+            rng = np.random.default_rng(0)
+            lats, lons = rng.uniform(-80, 80, 40), rng.uniform(-180, 180, 40)
+            queries = [{"lat": lat, "lon": lon, "alt": 0, "dyear": 2026.0, "elements": "dec,inc"}
+                       for lat, lon in zip(lats, lons)]
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(post, queries))
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected = wmm.evaluate(lats, lons, 0, 2026.0)
+
+            self.assertTrue(all(status == 200 for status, _ in results))
+            np.testing.assert_array_equal([body["dec"] for _, body in results], expected["dec"])
+
+            status, body = post({"lat": list(lats[:3]), "lon": list(lons[:3]), "alt": 0, "dyear": 2026.0,
+                                 "elements": ["f"]})
+            self.assertEqual(status, 200)
+            np.testing.assert_array_equal(body["f"], expected["f"][:3])
+
+            self.assertEqual(post({"lat": 0, "lon": 0, "alt": 0, "dyear": 2031.0})[0], 400)
+            status, body = post({"lat": [], "lon": [], "alt": 0, "dyear": 2026.0})
+            self.assertEqual(status, 400)
+            self.assertIn("empty", body["error"])
+
+            with urllib.request.urlopen(url + "/metrics") as response:
+                metrics = response.read().decode("utf-8")
+            self.assertIn("wmm_requests_total 43", metrics)
+            self.assertIn("wmm_errors_total 2", metrics)
+            self.assertIn('wmm_request_latency_seconds{quantile="0.99"}', metrics)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # an invalid nmax fails at the launch
+        with self.assertRaises(ValueError):
+            WMMServer(("127.0.0.1", 0), nmax=13)
+
+    def test_batch(self):
+        import io
+        import wmm
+        from wmm import batch
+
+        inp = io.StringIO("id,latitude,lon,alt,date\n"
+                          "a,23.35,40,21,2026-01-01\n"
+                          "b,-45.5,170.25,0,2027-07-02T12:00:00\n"
+                          "\n"
+                          "c,80,-120,100,2029-12-31\n")
+        out = io.StringIO()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            num_rows = batch.run_batch(inp, out, ("dec", "inc"), chunk_size=2, columns={"lat": "latitude"})
+            expected = wmm.evaluate([23.35, -45.5, 80], [40, 170.25, -120], [21, 0, 100],
+                                    [util.calc_dec_year(2026, 1, 1), util.calc_dec_year(2027, 7, 2, 12),
+                                     util.calc_dec_year(2029, 12, 31)], elements=["dec", "inc"])
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(num_rows, 3)
+        self.assertEqual(lines[0], "id,latitude,lon,alt,date,dec,inc")
+        self.assertTrue(lines[1].startswith("a,23.35,40,21,2026-01-01,"))
+        vals = np.array([line.split(",")[-2:] for line in lines[1:]], dtype=float)
+        np.testing.assert_allclose(vals[:, 0], expected["dec"], atol=1e-6)
+        np.testing.assert_allclose(vals[:, 1], expected["inc"], atol=1e-6)
+
+        inp = io.StringIO('{"lat": 23.35, "lon": 40, "alt": 21, "dyear": 2026.5}\n')
+        out = io.StringIO()
+        batch.run_batch(inp, out, ("f",), fmt="ndjson", precision=3)
+        row = json.loads(out.getvalue())
+        self.assertEqual(list(row.keys()), ["lat", "lon", "alt", "dyear", "f"])
+        self.assertAlmostEqual(row["f"], wmm.evaluate(23.35, 40, 21, 2026.5)["f"][0], places=3)
+
+        with self.assertRaises(ValueError):
+            batch.run_batch(io.StringIO("lat,lon,height,dyear\n0,0,0,2026\n"), io.StringIO(), ("f",))
+
+        cmd = [sys.executable, "-m", "wmm", "batch", "--elements", "dec", "--precision", "2"]
+        proc = subprocess.run(cmd, input="lat,lon,alt,dyear\n23.35,40,21,2026.5\n", capture_output=True, text=True,
+                              cwd=self.top_dir)
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(proc.stdout, f"lat,lon,alt,dyear,dec\n23.35,40,21,2026.5,{wmm.evaluate(23.35, 40, 21, 2026.5)['dec'][0]:.2f}\n")
+
+        # a comma in the name of a csv file doesn't make it a list of column files
+        self.assertEqual(batch.detect_format("run,2026.csv"), "csv")
+        self.assertEqual(batch.detect_format("stations,v2.jsonl"), "ndjson")
+        self.assertEqual(batch.detect_format("lat.f8,lon.f8,alt.f8,dyear.f8"), "npy")
+        self.assertEqual(batch.detect_format("points.npy"), "npy")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name) for name in ("lat", "lon", "alt", "dyear")]
+            for path in paths:
+                open(path, "wb").close()
+            self.assertEqual(batch.detect_format(",".join(paths)), "npy")
+
+    def test_npy_batch(self):
+        import wmm
+        from wmm import batch
+
+        rng = np.random.default_rng(0)
+        points = np.column_stack([rng.uniform(-80, 80, 25), rng.uniform(-180, 180, 25), rng.uniform(0, 100, 25),
+                                  rng.uniform(2025, 2029.9, 25)])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = wmm.evaluate(*points.T, elements=["dec", "f"])
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                np.save(os.path.join(tmp_dir, "points.npy"), points)
+                paths = []
+                for i, name in enumerate(["lat", "lon", "alt", "dyear"]):
+                    paths.append(os.path.join(tmp_dir, f"{name}.f8"))
+                    points[:, i].astype("<f8").tofile(paths[-1])
+
+                for inp in [os.path.join(tmp_dir, "points.npy"), ",".join(paths)]:
+                    out_dir = os.path.join(tmp_dir, "out")
+                    cols = batch.open_columns(inp)
+                    self.assertIsInstance(cols[0], np.memmap)
+
+                    self.assertEqual(batch.run_npy_batch(cols, out_dir, ("dec", "f"), chunk_size=10, source=inp), 25)
+                    np.testing.assert_array_equal(np.load(os.path.join(out_dir, "dec.npy")), expected["dec"])
+                    np.testing.assert_array_equal(np.load(os.path.join(out_dir, "f.npy")), expected["f"])
+
+                # pretend the run was interrupted after the first chunk
+                progress_path = os.path.join(out_dir, batch.PROGRESS_FILE)
+                with open(progress_path, "r") as fp:
+                    progress = json.load(fp)
+                progress["completed"] = 10
+                with open(progress_path, "w") as fp:
+                    json.dump(progress, fp)
+                dec = np.lib.format.open_memmap(os.path.join(out_dir, "dec.npy"), mode="r+")
+                dec[:10] = -1.0
+                dec[10:] = np.nan
+                dec.flush()
+                del dec
+
+                batch.run_npy_batch(cols, out_dir, ("dec", "f"), chunk_size=10, resume=True, source=inp)
+                dec = np.load(os.path.join(out_dir, "dec.npy"))
+                np.testing.assert_array_equal(dec[:10], -1.0)
+                np.testing.assert_array_equal(dec[10:], expected["dec"][10:])
+
+                with self.assertRaises(ValueError):
+                    batch.run_npy_batch(cols, out_dir, ("inc",), chunk_size=10, resume=True, source=inp)
+
+    def test_parallel_evaluate(self):
+        import wmm.parallel
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+
+        expected = wmm_model.get_all()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = wmm.parallel.evaluate(self.lats, self.lons, self.alts, self.dyears, processes=2, chunk_size=4)
+
+        self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+        for key in expected:
+            np.testing.assert_allclose(mag_map[key], expected[key], rtol=1e-12, atol=1e-9)
+
+        mag_map = wmm.parallel.evaluate(self.lats[0], self.lons[0], self.alts[0], self.dyears[0],
+                                        elements=["inc", "dec"], processes=1)
+        self.assertEqual(list(mag_map.keys()), ["dec", "inc"])
+        self.assertAlmostEqual(mag_map["dec"][0], expected["dec"][0], places=9)
+
+        with self.assertRaises(ValueError):
+            wmm.parallel.evaluate(self.lats, self.lons, self.alts, 2031.0, processes=2)
+
+    def test_approx(self):
+        import wmm
+        from wmm.approx import wmm_approx
+
+        model = wmm_approx.build(resolution=1.0, alts=[-1, 10, 100])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = wmm.evaluate(self.lats, self.lons, self.alts, self.dyears)
+        mag_map = model.evaluate(self.lats, self.lons, self.alts, self.dyears)
+
+        self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+        for key in ("x", "y", "z", "f"):
+            np.testing.assert_allclose(mag_map[key], expected[key], atol=50)
+
+        # the time is exact, so the change over time is the secular variation
+        later = model.evaluate(self.lats, self.lons, self.alts, np.array(self.dyears) + 1.0, elements=["x"])
+        np.testing.assert_allclose(later["x"] - mag_map["x"], mag_map["dx"], atol=1e-6)
+
+        errors = model.validate(num_points=2000)
+        self.assertLess(errors["dec"]["max"], 0.5)
+        self.assertLess(errors["f"]["max"], 50)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "tiles.npz")
+            model.save(path)
+            loaded = wmm_approx.load(path)
+        self.assertEqual(loaded.meta, model.meta)
+        np.testing.assert_array_equal(loaded.evaluate(self.lats, self.lons, self.alts, self.dyears, elements=["dec"])["dec"],
+                                      mag_map["dec"])
+
+        with self.assertRaises(ValueError):
+            model.evaluate(self.lats, self.lons, 200, self.dyears)
+        with self.assertRaises(ValueError):
+            model.evaluate(self.lats, self.lons, self.alts, 2031.0)
+
+    def test_cache(self):
+        import wmm
+        from wmm.cache import wmm_cache
+
+        cache = wmm_cache(max_size=len(self.lats))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = cache.evaluate(self.lats, self.lons, self.alts, self.dyears)
+            expected = wmm.evaluate(self.lats, self.lons, self.alts, self.dyears)
+
+        self.assertEqual(list(mag_map.keys()), list(expected.keys()))
+        for key in ("x", "y", "z", "f"):
+            np.testing.assert_allclose(mag_map[key], expected[key], atol=1)
+        self.assertEqual(cache.stats()["misses"], len(self.lats))
+
+        # the nearby points share the results of the same node
+        mag_map = cache.evaluate(np.array(self.lats) + 1e-5, self.lons, self.alts, self.dyears, elements=["dec"])
+        np.testing.assert_array_equal(mag_map["dec"], cache.evaluate(self.lats, self.lons, self.alts, self.dyears)["dec"])
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2 * len(self.lats))
+        self.assertEqual(stats["evictions"], 0)
+
+        # only the new points are computed, and the oldest points are evicted
+        cache.evaluate([0, 0, 1], [0, 0, 1], 0, 2026.0, elements=["f"])
+        stats = cache.stats()
+        self.assertEqual(stats["misses"], len(self.lats) + 3)
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["size"], len(self.lats))
+
+        cache.clear()
+        self.assertEqual(cache.stats()["size"], 0)
+
+        with self.assertRaises(ValueError):
+            wmm_cache(lat_step=0)
+
+        # the nodes of the dates at both bounds fall outside of the valid period
+        coef_dict = load.load_wmm_coefs(self.wmm_file, 12)
+        min_year, max_year = float(coef_dict["min_year"][0]), coef_dict["epoch"] + 5.0
+        dyears = [min_year, min_year + 1e-6, max_year - 1e-6]
+        cache = wmm_cache(lat_step=1.0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = cache.evaluate([0, 89.7, -89.7], 0, 0, dyears)
+            expected = wmm.evaluate([0, 89.7, -89.7], 0, 0, dyears)
+        for key in expected:
+            np.testing.assert_array_equal(mag_map[key], expected[key])
+        with self.assertRaises(ValueError):
+            cache.evaluate(0, 0, 0, max_year)
+
+    def test_prepared_points(self):
+        from wmm import prepared
+
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=self.dyears)
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        expected = wmm_model.get_all()
+
+        prepared.clear_cache()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            points = prepared.prepare(self.lats, self.lons, self.alts, cache_dir=tmp_dir)
+            self.assertIs(prepared.prepare(self.lats, self.lons, self.alts), points)
+            self.assertEqual(os.listdir(tmp_dir), [f"{points.key}.npz"])
+
+            # a restarted worker reads the geometry from the disk
+            prepared.clear_cache()
+            loaded = prepared.prepare(self.lats, self.lons, self.alts, cache_dir=tmp_dir)
+            self.assertIsNot(loaded, points)
+
+        for pts in (points, loaded):
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=self.dyears)
+            wmm_model.setup_points(pts)
+            mag_map = wmm_model.get_all()
+            for key in expected:
+                np.testing.assert_array_equal(mag_map[key], expected[key])
+
+        # the same points for another date
+        wmm_model.setup_time(dyear=2028.0)
+        wmm_model.setup_points(loaded)
+        mag_map = wmm_model.get_all()
+        wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+        np.testing.assert_array_equal(mag_map["dec"], wmm_model.get_all()["dec"])
+
+        with self.assertRaises(AttributeError):
+            points.lat = np.zeros(len(points))
+        with self.assertRaises(ValueError):
+            points.lat[0] = 0.0
+        with self.assertRaises(ValueError):
+            wmm_calc(nmax=6).setup_points(points)
+
+    def test_update_points(self):
+        lats, lons, alts = np.array(self.lats), np.array(self.lons), np.array(self.alts)
+        moved = np.array([3, 0])
+        new_lats, new_lons, new_alts = lats.copy(), lons.copy(), alts.copy()
+        new_lats[moved], new_lons[moved], new_alts[moved] = [-45.0, 10.0], [120.0, -60.0], [5.0, 0.5]
+
+        expected = {}
+        for dyears in (2026.5, np.array(self.dyears)):
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=dyears)
+            wmm_model.setup_env(new_lats, new_lons, new_alts, msl=False)
+            expected[np.size(dyears)] = wmm_model.get_all()
+
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=dyears)
+            wmm_model.setup_env(lats, lons, alts, msl=False)
+            old_dec = wmm_model.get_all()["dec"]
+
+            wmm_model.update_points(moved, new_lats[moved], new_lons[moved], new_alts[moved] * 1000, unit="m")
+            mag_map = wmm_model.get_all()
+            for key in expected[np.size(dyears)]:
+                np.testing.assert_array_equal(mag_map[key], expected[np.size(dyears)][key])
+            # the results returned before are not modified
+            self.assertNotEqual(old_dec[0], mag_map["dec"][0])
+
+        # setup_env() only recomputes the changed point
+        wmm_model = wmm_calc()
+        wmm_model.setup_time(dyear=2026.5)
+        wmm_model.setup_env(new_lats, new_lons, new_alts, msl=False)
+        wmm_model.get_all()
+        misses = wmm_model.cache_stats["misses"]
+        wmm_model.setup_env(new_lats, new_lons, new_alts, msl=False)
+        wmm_model.get_all()
+        self.assertEqual(wmm_model.cache_stats["misses"], misses)
+
+        # one of the points moves back, so it is patched instead of recomputing all of the points
+        new_lats[0] = lats[0]
+        wmm_model.setup_env(new_lats, new_lons, new_alts, msl=False)
+        mag_map = wmm_model.get_all()
+        self.assertEqual(wmm_model.cache_stats["misses"], misses)
+
+        fresh_model = wmm_calc()
+        fresh_model.setup_time(dyear=2026.5)
+        fresh_model.setup_env(new_lats, new_lons, new_alts, msl=False)
+        np.testing.assert_array_equal(mag_map["dec"], fresh_model.get_all()["dec"])
+
+        with self.assertRaises(ValueError):
+            wmm_model.update_points([len(lats)], 0, 0, 0)
+        with self.assertRaises(ValueError):
+            wmm_model.update_points([0, 1], [0, 1, 2], 0, 0)
+
+    def test_dedup(self):
+        # every point three times in a shuffled order
+        order = np.random.default_rng(0).permutation(3 * len(self.lats))
+        lats, lons, alts, dyears = [np.tile(val, 3)[order] for val in (self.lats, self.lons, self.alts, self.dyears)]
+
+        for dyear in (2026.5, dyears):
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=dyear)
+            wmm_model.setup_env(lats, lons, alts, msl=False)
+            expected = wmm_model.get_all()
+
+            for kernel in ("tables", "recursive"):
+                wmm_model = wmm_calc(dedup=True, kernel=kernel)
+                wmm_model.setup_time(dyear=dyear)
+                wmm_model.setup_env(lats, lons, alts, msl=False)
+                mag_map = wmm_model.get_all()
+
+                for key in expected:
+                    np.testing.assert_array_equal(mag_map[key], expected[key])
+                np.testing.assert_array_equal(wmm_model.get_elements(["dec"])["dec"], expected["dec"])
+
+            stats = wmm_model.dedup_stats
+            self.assertEqual(stats["rows"], len(lats))
+            self.assertEqual(stats["points"], len(set(zip(self.lats, self.lons, self.alts))))
+            self.assertLessEqual(stats["lat_alt_pairs"], stats["points"])
+            self.assertAlmostEqual(stats["saved"], 1.0 - stats["points"] / stats["rows"])
+
+    def test_recursive_kernel(self):
+        testval = os.path.join(self.top_dir, "tests", "WMM2025_FINAL_TEST_VALUES_HIGHPREC.txt")
+        vals = np.loadtxt(testval, comments="#")
+        dyears, alts, lats, lons = vals[:, 0], vals[:, 1], vals[:, 2], vals[:, 3]
+        # the columns of the test values and their tolerances, the angles are rounded to 2 decimals
+        columns = {"dec": (4, 0.0051), "inc": (5, 0.0051), "h": (6, 1e-3), "x": (7, 1e-3), "y": (8, 1e-3),
+                   "z": (9, 1e-3), "f": (10, 1e-3), "ddec": (11, 1e-6), "dinc": (12, 1e-6), "dh": (13, 1e-6),
+                   "dx": (14, 1e-6), "dy": (15, 1e-6), "dz": (16, 1e-6), "df": (17, 1e-6)}
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for dyear in (2026.5, dyears):
+                mag_maps = {}
+                for kernel in ("tables", "recursive"):
+                    wmm_model = wmm_calc(kernel=kernel)
+                    wmm_model.setup_time(dyear=dyear)
+                    wmm_model.setup_env(lats, lons, alts, msl=False)
+                    mag_maps[kernel] = wmm_model.get_all()
+                    self.assertEqual(len(wmm_model.Leg) == 0, kernel == "recursive")
+
+                    chunked = wmm_model.get_all(chunk_size=7)
+                    for key in chunked:
+                        np.testing.assert_array_equal(chunked[key], mag_maps[kernel][key])
+
+                for key in mag_maps["tables"]:
+                    np.testing.assert_array_equal(mag_maps["recursive"][key], mag_maps["tables"][key])
+
+        # the results of the dates of the test values
+        for key, (col, tol) in columns.items():
+            np.testing.assert_allclose(mag_maps["recursive"][key], vals[:, col], atol=tol)
+
+        with self.assertRaises(ValueError):
+            wmm_calc(kernel="clenshaw")
+
+    def test_low_memory(self):
+        for dyear in (2026.5, self.dyears):
+            wmm_model = wmm_calc()
+            wmm_model.setup_time(dyear=dyear)
+            wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+            expected = wmm_model.get_all()
+
+            wmm_model = wmm_calc(low_memory=True)
+            wmm_model.setup_time(dyear=dyear)
+            wmm_model.setup_env(self.lats, self.lons, self.alts, msl=False)
+            mag_map = wmm_model.get_all()
+            for key in expected:
+                np.testing.assert_array_equal(mag_map[key], expected[key])
+            # the legendre functions are never kept in the instance
+            self.assertEqual(len(wmm_model.Leg), 0)
+            self.assertEqual(wmm_model.sph_dict, {})
+
+            wmm_model.release_memory()
+            self.assertEqual(wmm_model.results, {})
+            np.testing.assert_array_equal(wmm_model.get_Bx(), expected["x"])
+
+        with self.assertRaises(ValueError):
+            wmm_calc(dedup=True, low_memory=True)
+
+    def test_low_memory_budget(self):
+        # the bytes per point allocated by setup_env() and get_all(), including the returned elements
+        budget = 256
+        num_points = 1000000
+
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(-89, 89, num_points)
+        lons = rng.uniform(-180, 180, num_points)
+
+        wmm_model = wmm_calc(low_memory=True)
+        wmm_model.setup_time(dyear=2026.5)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tracemalloc.start()
+            try:
+                wmm_model.setup_env(lats, lons, 10.0, msl=False)
+                mag_map = wmm_model.get_all()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(len(mag_map["dinc"]), num_points)
+        self.assertLess(peak / num_points, budget)
+
     def test_reset_env(self):
         lat = np.array([-18])
         lon = np.array([138])
@@ -1,10 +1,34 @@
-from .build import wmm_calc, wmm_elements
-from .uncertainty import err_model
+from importlib import import_module
 
-__all__ = ['wmm_calc', 'wmm_elements']
+__all__ = ['wmm_calc', 'wmm_elements', 'evaluate', 'aevaluate']
 
 __version__ = "1.3.1"
 
+# The submodules pull in numpy and geomaglib, so they are imported on first use
+# to keep "import wmm" cheap for command line tools and serverless functions.
+_lazy_attrs = {
+    "wmm_calc": "build",
+    "wmm_elements": "build",
+    "evaluate": "build",
+    "aevaluate": "aio",
+    "err_model": "uncertainty",
+    "wmm_approx": "approx",
+    "wmm_cache": "cache",
+}
+_lazy_submodules = ("aio", "approx", "batch", "cache", "parallel", "prepared", "serve")
 
 
+def __getattr__(name):
+    if name in _lazy_attrs:
+        module = import_module(f".{_lazy_attrs[name]}", __name__)
+        val = getattr(module, name)
+        globals()[name] = val
+        return val
+    if name in _lazy_submodules:
+        return import_module(f".{name}", __name__)
 
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy_attrs.keys()) + list(_lazy_submodules))
@@ -0,0 +1,35 @@
+import argparse
+
+from wmm import approx, batch
+
+
+def main(argv=None):
+    """
+    The command line entry of wmm:
+
+        python -m wmm batch --in points.csv --out results.csv --elements dec,inc
+        python -m wmm approx validate --tiles tiles.npz
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m wmm", description="World Magnetic Model command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="compute the magnetic elements of the points in a file",
+                                         description="Stream the points of a csv or ndjson file in chunks and "
+                                                     "write the magnetic elements of every row")
+    batch.add_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch.main, parser=batch_parser)
+
+    approx_parser = subparsers.add_parser("approx", help="build or validate the tiles of the approximate model",
+                                          description="Precompute the field on a lat/lon/alt lattice for "
+                                                      "wmm_approx, or compare the approximate model with the full "
+                                                      "model at random points")
+    approx.add_arguments(approx_parser)
+    approx_parser.set_defaults(func=approx.main, parser=approx_parser)
+
+    args = parser.parse_args(argv)
+    args.func(args, args.parser)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import Executor
+from typing import Optional, Union
+
+import numpy as np
+
+from wmm.build import evaluate, check_nmax, check_elements, ALL_ELEMENTS
+
+# The time in seconds to wait for more single-point calls before they are computed in one batch
+COALESCE_WINDOW = 0.002
+# The max number of single-point calls computed in one batch
+COALESCE_MAX_BATCH = 4096
+
+# The coalescers of every running event loop, keyed by the settings of the calls
+_coalescers = weakref.WeakKeyDictionary()
+
+
+class Coalescer:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, executor: Optional[Executor] = None, nmax: int = 12,
+                 unit: str = "km", msl: bool = False, window: Optional[float] = None,
+                 max_batch: Optional[int] = None):
+        """
+        Collect the single-point calls arriving within a short window and compute them with one vectorized
+        wmm.evaluate() in the executor. The results are split back out to the awaiting callers.
+
+        :param loop: the event loop of the callers
+        :param executor: default is the default executor of the loop. The executor to compute the batches.
+        :param nmax: max degree
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+        :param window: default is COALESCE_WINDOW. The time in seconds to wait for more calls.
+        :param max_batch: default is COALESCE_MAX_BATCH. The batch is computed at once if it reaches the size.
+        """
+
+        self.loop = loop
+        self.executor = executor
+        self.nmax = nmax
+        self.unit = unit
+        self.msl = msl
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.timer = None
+        # the event loop only keeps weak references to the tasks, so the running batches are kept here
+        self.tasks = set()
+        self.stats = {"calls": 0, "batches": 0}
+
+    def submit(self, lat: float, lon: float, alt: float, dyear: float, elements: tuple) -> asyncio.Future:
+        """
+        Add one point to the current batch.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: altitude
+        :param dyear: decimal year
+        :param elements: the names of the magnetic elements
+        :return: the future of the dict object includes the requested magnetic elements
+        """
+
+        future = self.loop.create_future()
+        self.pending.append((lat, lon, alt, dyear, elements, future))
+        self.stats["calls"] += 1
+
+        max_batch = COALESCE_MAX_BATCH if self.max_batch is None else self.max_batch
+        window = COALESCE_WINDOW if self.window is None else self.window
+
+        if len(self.pending) >= max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(window, self.flush)
+
+        return future
+
+    def flush(self):
+        """
+        Start computing the points collected so far.
+        """
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            self.stats["batches"] += 1
+            task = self.loop.create_task(self.run_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch: list):
+        """
+        Compute the batch in the executor and set the results of the callers. If the batch fails, e.g. one of the
+        points is out of the valid range, it is split into halves until only the invalid callers get the exception.
+
+        :param batch: the list of (lat, lon, alt, dyear, elements, future)
+        """
+
+        lat, lon, alt, dyear = (np.array([item[i] for item in batch], dtype=np.float64) for i in range(4))
+        elements = tuple(key for key in ALL_ELEMENTS if any(key in item[4] for item in batch))
+
+        try:
+            mag_map = await self.loop.run_in_executor(self.executor, functools.partial(
+                evaluate, lat, lon, alt, dyear, elements=elements, nmax=self.nmax, unit=self.unit, msl=self.msl))
+        except Exception as err:
+            if len(batch) == 1:
+                if not batch[0][5].done():
+                    batch[0][5].set_exception(err)
+                return
+            half = len(batch) // 2
+            await asyncio.gather(self.run_batch(batch[:half]), self.run_batch(batch[half:]))
+            return
+
+        for i, (_, _, _, _, keys, future) in enumerate(batch):
+            if not future.done():
+                future.set_result({key: mag_map[key][i:i + 1] for key in keys})
+
+
+def get_coalescer(executor: Optional[Executor], nmax: int, unit: str, msl: bool) -> Coalescer:
+    """
+    Get the coalescer of the running event loop for the settings.
+
+    :param executor: the executor to compute the batches
+    :param nmax: max degree
+    :param unit: the unit of altitude
+    :param msl: True if the altitude is the height above mean sea level
+    :return: Coalescer object
+    """
+
+    loop = asyncio.get_running_loop()
+    coalescers = _coalescers.setdefault(loop, {})
+
+    key = (id(executor), nmax, unit, msl)
+    if key not in coalescers or coalescers[key].executor is not executor:
+        coalescers[key] = Coalescer(loop, executor, nmax, unit, msl)
+
+    return coalescers[key]
+
+
+async def aevaluate(lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+                    alt: Union[int, float, list, np.ndarray], dyear: Union[int, float, list, np.ndarray],
+                    elements: Optional[Union[list, tuple]] = None, nmax: int = 12, unit: str = "km",
+                    msl: bool = False, executor: Optional[Executor] = None, coalesce: bool = True) -> dict:
+    """
+    The asyncio version of wmm.evaluate(). The computation is offloaded to the executor, so it doesn't block the
+    event loop. Single-point calls arriving within COALESCE_WINDOW seconds are coalesced into one vectorized batch,
+    and the results are split back out to the callers.
+
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude in km, meter or feet
+    :param dyear: decimal year
+    :param elements: default is all of the elements. The names of the magnetic elements, the keys of get_all().
+    :param nmax: max degree
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param executor: default is the default executor of the event loop. The executor to compute the elements.
+    :param coalesce: default is True. Set it to False to compute the single-point call on its own.
+    :return: dict object includes the requested magnetic elements
+    """
+
+    # the settings shared by a batch are checked before the call joins it, so an invalid nmax or elements fails
+    # once here instead of in every split of the batch
+    check_nmax(nmax)
+    elements = check_elements(elements)
+
+    point = (lat, lon, alt, dyear)
+    if coalesce and all(np.size(val) == 1 for val in point):
+        point = tuple(float(np.ravel(val)[0]) for val in point)
+
+        return await get_coalescer(executor, nmax, unit, msl).submit(*point, elements)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(
+        evaluate, lat, lon, alt, dyear, elements=elements, nmax=nmax, unit=unit, msl=msl))
@@ -0,0 +1,299 @@
+import json
+import argparse
+import warnings
+from typing import Optional, Union
+
+import numpy as np
+
+from wmm.build import wmm_calc, wmm_elements, evaluate, check_elements, broadcast_points, to_km, check_coords, \
+    check_time_range, ALL_ELEMENTS
+
+# The default spacing in degree of the latitude and longitude lattice
+DEFAULT_RESOLUTION = 0.5
+# The default ellipsoid heights in km of the lattice
+DEFAULT_ALTS = (-1.0, 0.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+# The geomagnetic reference radius in km
+EARTH_RADIUS = 6371.2
+
+# The components kept in the tiles. The field at any date is x + (dyear - epoch) * dx.
+TILE_KEYS = ("x", "y", "z", "dx", "dy", "dz")
+# The pole rows are computed this many degrees off the poles, where the legendre functions are shifted by geomaglib
+POLE_OFFSET = 0.01
+# The number of points interpolated at once
+INTERP_CHUNK = 8192
+
+
+def radius_scale(alt: np.ndarray) -> np.ndarray:
+    """
+    The inverse of the dipole decay (a / r) ** 3 at the altitude.
+
+    :param alt: the altitude in km
+    :return: (r / a) ** 3
+    """
+
+    return ((EARTH_RADIUS + alt) / EARTH_RADIUS) ** 3
+
+
+class wmm_approx():
+
+    def __init__(self, tiles: np.ndarray, lats: np.ndarray, lons: np.ndarray, alts: np.ndarray, meta: dict):
+        """
+        The approximate WMM model interpolating the field from the tiles precomputed on a lat/lon/alt lattice.
+        Use wmm_approx.build() to compute the tiles or wmm_approx.load() to read them from a file.
+
+        The main field and secular variation at the epoch are interpolated bilinearly in latitude and longitude and
+        linearly in altitude after the dipole decay is taken out. The time is applied with
+        B(epoch) + (dyear - epoch) * SV, which is exact for WMM. With the default lattice of 0.5 degree and 8
+        altitudes from -1 to 100 km, the max errors against the full model outside the blackout zone are about
+        0.02 degree in declination, 0.005 degree in inclination and 6 nT in X, Y, Z and F, see validate().
+
+        :param tiles: X, Y, Z, dX, dY, dZ at the epoch times (r / a) ** 3 in (nalt, nlat, nlon, 6)
+        :param lats: latitudes in degree of the lattice from -90 to 90 with a constant spacing
+        :param lons: longitudes in degree of the lattice from -180 to 180 with a constant spacing
+        :param alts: ellipsoid heights in km of the lattice in ascending order
+        :param meta: epoch, min_year, min_date, model_name and nmax of the model
+        """
+
+        self.tiles = np.ascontiguousarray(tiles, dtype=np.float32)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.alts = np.asarray(alts, dtype=np.float64)
+        self.meta = meta
+
+        if self.tiles.shape != (len(self.alts), len(self.lats), len(self.lons), len(TILE_KEYS)):
+            raise ValueError(f"The tiles in the shape of {self.tiles.shape} don't match the lattice.")
+        if len(self.alts) < 2 or np.any(np.diff(self.alts) <= 0):
+            raise ValueError("Please provide at least two altitudes in ascending order.")
+
+        self.dlat = self.lats[1] - self.lats[0]
+        self.dlon = self.lons[1] - self.lons[0]
+        # every lattice point is one row of the six components, so a corner is gathered at once
+        self.flat_tiles = self.tiles.reshape(-1, len(TILE_KEYS))
+
+    @classmethod
+    def build(cls, resolution: float = DEFAULT_RESOLUTION, alts: Union[list, tuple, np.ndarray] = DEFAULT_ALTS,
+              nmax: int = 12) -> "wmm_approx":
+        """
+        Compute the tiles with wmm_calc.grid() at the epoch of the model.
+
+        :param resolution: default is 0.5. The spacing in degree of the latitude and longitude lattice. It should
+        divide 180.
+        :param alts: the ellipsoid heights in km of the lattice
+        :param nmax: max degree
+        :return: wmm_approx object
+        """
+
+        num_lats = int(round(180.0 / resolution))
+        if num_lats <= 0 or not np.isclose(num_lats * resolution, 180.0):
+            raise ValueError("Please provide the resolution which divides 180 degree.")
+
+        lats = np.linspace(-90.0, 90.0, num_lats + 1)
+        lons = np.linspace(-180.0, 180.0, 2 * num_lats + 1)
+        alts = np.sort(np.asarray(alts, dtype=np.float64).ravel())
+
+        grid_lats = lats.copy()
+        grid_lats[0] += POLE_OFFSET
+        grid_lats[-1] -= POLE_OFFSET
+
+        model = wmm_calc(nmax)
+        coef_dict = model.load_coeffs()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            mag_map = model.grid(grid_lats, lons, alts, dyear=coef_dict["epoch"], elements=TILE_KEYS)
+
+        # (nlat, nlon, nalt) to (nalt, nlat, nlon). The dipole decay is taken out so the field is close to linear
+        # in altitude.
+        tiles = np.stack([np.moveaxis(mag_map[key], 2, 0) for key in TILE_KEYS], axis=-1)
+        tiles *= radius_scale(alts)[:, None, None, None]
+        meta = {key: coef_dict[key] for key in ("epoch", "model_name", "min_date")}
+        meta["min_year"] = float(np.ravel(coef_dict["min_year"])[0])
+        meta["nmax"] = nmax
+
+        return cls(tiles, lats, lons, alts, meta)
+
+    @classmethod
+    def load(cls, path: str) -> "wmm_approx":
+        """
+        Read the tiles saved by wmm_approx.save().
+
+        :param path: the path of .npz file
+        :return: wmm_approx object
+        """
+
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(data["tiles"], data["lats"], data["lons"], data["alts"], meta)
+
+    def save(self, path: str):
+        """
+        Save the tiles in float32 to a compressed .npz file.
+
+        :param path: the path of .npz file
+        """
+
+        np.savez_compressed(path, tiles=self.tiles, lats=self.lats, lons=self.lons, alts=self.alts,
+                            meta=json.dumps(self.meta))
+
+    def interpolate(self, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray) -> tuple:
+        """
+        Interpolate X, Y, Z, dX, dY, dZ at the epoch from the tiles. The points are gathered in chunks of
+        INTERP_CHUNK so the intermediate arrays stay in the cache.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: ellipsoid height in km
+        :return: X, Y, Z, dX, dY, dZ in float64
+        """
+
+        nlat, nlon, nalt = len(self.lats), len(self.lons), len(self.alts)
+        num_points = lat.size
+        vals = np.zeros((num_points, len(TILE_KEYS)))
+        corner = np.empty((min(num_points, INTERP_CHUNK), len(TILE_KEYS)))
+
+        for start in range(0, num_points, INTERP_CHUNK):
+            stop = min(start + INTERP_CHUNK, num_points)
+
+            lat_idx = (lat[start:stop] - self.lats[0]) / self.dlat
+            i = np.clip(lat_idx.astype(np.int64), 0, nlat - 2)
+            wi = lat_idx - i
+
+            lon_idx = np.mod(lon[start:stop] - self.lons[0], 360.0) / self.dlon
+            j = np.clip(lon_idx.astype(np.int64), 0, nlon - 2)
+            wj = lon_idx - j
+
+            alt_chunk = alt[start:stop]
+            k = np.clip(np.searchsorted(self.alts, alt_chunk, side="right") - 1, 0, nalt - 2)
+            wk = (alt_chunk - self.alts[k]) / (self.alts[k + 1] - self.alts[k])
+
+            base = (k * nlat + i) * nlon + j
+            out = vals[start:stop]
+            buf = corner[:stop - start]
+            for offset, weight in ((0, (1.0 - wk) * (1.0 - wi)), (nlon, (1.0 - wk) * wi),
+                                   (nlat * nlon, wk * (1.0 - wi)), (nlat * nlon + nlon, wk * wi)):
+                row = base + offset
+                np.multiply(np.take(self.flat_tiles, row, axis=0), (weight * (1.0 - wj))[:, None], out=buf)
+                out += buf
+                row += 1
+                np.multiply(np.take(self.flat_tiles, row, axis=0), (weight * wj)[:, None], out=buf)
+                out += buf
+
+            out /= radius_scale(alt_chunk)[:, None]
+
+        return tuple(vals.T)
+
+    def evaluate(self, lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+                 alt: Union[int, float, list, np.ndarray], dyear: Union[int, float, list, np.ndarray],
+                 elements: Optional[Union[list, tuple]] = None, unit: str = "km") -> dict:
+        """
+        Compute the approximate magnetic elements. The arguments are the same as wmm.evaluate().
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: ellipsoid height in km, meter or feet. It should be within the altitudes of the lattice.
+        :param dyear: decimal year
+        :param elements: default is all of the elements. The names of the magnetic elements, the keys of get_all().
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :return: dict object includes the requested magnetic elements
+        """
+
+        elements = check_elements(elements)
+        lat, lon, alt, dyear = broadcast_points(lat, lon, alt, dyear)
+
+        alt = to_km(alt, unit)
+        check_coords(lat, lon, alt)
+        check_time_range(dyear, self.meta)
+        if np.any(alt < self.alts[0]) or np.any(alt > self.alts[-1]):
+            raise ValueError(f"The altitude is out of the lattice. Please provide altitude from {self.alts[0]} to {self.alts[-1]} km.")
+
+        Bx, By, Bz, dBx, dBy, dBz = self.interpolate(lat, lon, alt)
+
+        date_diff = dyear - self.meta["epoch"]
+        Bx += date_diff * dBx
+        By += date_diff * dBy
+        Bz += date_diff * dBz
+
+        return wmm_elements(Bx, By, Bz, dBx, dBy, dBz).get_elements(elements)
+
+    def validate(self, num_points: int = 100000, seed: int = 0) -> dict:
+        """
+        Compare the approximate elements with the full model at random points. The points are uniform on the sphere
+        within the altitudes of the lattice and the valid dates of the model. The points in the blackout zone
+        (H < 2000 nT), where the declination is undefined, are not counted.
+
+        :param num_points: the number of random points
+        :param seed: the seed of the random points
+        :return: dict object includes the max, 99th percentile and rms of the absolute errors of every element,
+        and the number of points compared
+        """
+
+        rng = np.random.default_rng(seed)
+        lat = np.rad2deg(np.arcsin(rng.uniform(-1.0, 1.0, num_points)))
+        lon = rng.uniform(-180.0, 180.0, num_points)
+        alt = rng.uniform(self.alts[0], self.alts[-1], num_points)
+        dyear = rng.uniform(self.meta["min_year"], self.meta["epoch"] + 5.0 - 1e-6, num_points)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = evaluate(lat, lon, alt, dyear, nmax=self.meta["nmax"])
+            approx = self.evaluate(lat, lon, alt, dyear)
+
+        mask = expected["h"] >= 2000.0
+        errors = {}
+        for key in ALL_ELEMENTS:
+            diff = np.abs(approx[key] - expected[key])[mask]
+            if key == "dec":
+                # the declination wraps around at +-180 degree
+                diff = np.minimum(diff, 360.0 - diff)
+            errors[key] = {"max": float(np.max(diff)), "p99": float(np.percentile(diff, 99)),
+                           "rms": float(np.sqrt(np.mean(diff ** 2)))}
+        errors["points"] = int(np.count_nonzero(mask))
+
+        return errors
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("action", choices=["build", "validate"],
+                        help="build the tiles to a file, or validate the tiles against the full model")
+    parser.add_argument("--tiles", default=None,
+                        help="the .npz file of the tiles. build writes it, and validate reads it or builds the "
+                             "default tiles if it's not given")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION,
+                        help=f"the spacing in degree of the lattice. Default is {DEFAULT_RESOLUTION}")
+    parser.add_argument("--alts", default=",".join(str(alt) for alt in DEFAULT_ALTS),
+                        help="comma separated ellipsoid heights in km of the lattice")
+    parser.add_argument("--points", type=int, default=100000,
+                        help="the number of random points of validate. Default is 100000")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random points of validate")
+
+
+def main(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """
+    Run "python -m wmm approx".
+    """
+
+    if args.action == "build" and args.tiles is None:
+        parser.error("build needs --tiles to write the tiles")
+    if args.points <= 0:
+        parser.error("--points should be a positive integer")
+
+    try:
+        alts = [float(alt) for alt in args.alts.split(",") if alt.strip()]
+        if args.action == "validate" and args.tiles is not None:
+            model = wmm_approx.load(args.tiles)
+        else:
+            model = wmm_approx.build(args.resolution, alts)
+    except (ValueError, OSError) as err:
+        parser.exit(1, f"{parser.prog}: error: {err}\n")
+
+    if args.action == "build":
+        model.save(args.tiles)
+        print(f"Saved the tiles of {model.tiles.nbytes / 1e6:.1f} MB to {args.tiles}")
+        return
+
+    errors = model.validate(args.points, args.seed)
+    print(f"Compared {errors.pop('points')} points with the full model")
+    print(f"{'element':<8}{'max':>14}{'p99':>14}{'rms':>14}")
+    for key, err in errors.items():
+        print(f"{key:<8}{err['max']:>14.6f}{err['p99']:>14.6f}{err['rms']:>14.6f}")
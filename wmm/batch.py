@@ -0,0 +1,442 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import warnings
+from itertools import islice
+from typing import Iterator, Optional, TextIO
+
+import numpy as np
+
+from geomaglib import util
+
+from wmm.build import wmm_calc, check_elements, ALL_ELEMENTS
+from wmm.utils import iso_to_dyear
+
+# The number of rows read, computed and written at once
+DEFAULT_CHUNK_SIZE = 100000
+
+# The names of the date column looked up in the header if --date-col is not provided
+DATE_COLUMNS = ("dyear", "date", "time", "datetime")
+
+# The file saving the last completed chunk of a npy batch in the output folder
+PROGRESS_FILE = "progress.json"
+
+# The extensions of the .npy and raw binary column files in a comma separated input
+COLUMN_FILE_EXTENSIONS = (".npy", ".raw", ".bin", ".f4", ".f8")
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    Get the format of the file from its extension. The standard input and output are csv by default. A comma
+    separated path is a list of column files only if every part is an existing file or has a column file extension,
+    so a csv file like "run,2026.csv" is still read as csv.
+
+    :param path: the path of the file. "-" for stdin or stdout
+    :param fmt: default is None. "csv", "ndjson" or "npy" to override the extension
+    :return: "csv", "ndjson" or "npy"
+    """
+
+    if fmt is not None:
+        return fmt
+
+    if "," in path:
+        parts = [part.strip() for part in path.split(",")]
+        if all(os.path.isfile(part) or os.path.splitext(part)[1].lower() in COLUMN_FILE_EXTENSIONS for part in parts):
+            return "npy"
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ndjson", ".jsonl"):
+        return "ndjson"
+    if ext == ".npy":
+        return "npy"
+
+    return "csv"
+
+
+def parse_dates(values) -> np.ndarray:
+    """
+    Convert the date column to decimal years. The column is either decimal years or ISO 8601 dates.
+
+    :param values: the values of the date column
+    :return: numpy array of decimal years
+    """
+
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        return iso_to_dyear(values)
+
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return iso_to_dyear([str(val) for val in values])
+
+
+def find_column(names: list, name: Optional[str], candidates: tuple, label: str) -> int:
+    """
+    Find the index of the column in the header.
+
+    :param names: the names of the columns
+    :param name: the column name assigned by user. If it's None, the first candidate found in the header is used.
+    :param candidates: the default column names
+    :param label: the name of the input for the error message
+    :return: the index of the column
+    """
+
+    for key in ([name] if name is not None else candidates):
+        if key in names:
+            return names.index(key)
+
+    raise ValueError(f"Can't find the {label} column {name or list(candidates)} in the header {names}.")
+
+
+def read_csv_chunks(stream: TextIO, chunk_size: int, columns: dict) -> Iterator:
+    """
+    Read the csv stream in chunks.
+
+    :param stream: the text stream of csv with a header line
+    :param chunk_size: the number of rows of each chunk
+    :param columns: the column names of lat, lon, alt and date. None for the default names
+    :return: the header line, then the raw lines, lat, lon, alt and date columns of each chunk
+    """
+
+    header = stream.readline().rstrip("\r\n")
+    names = [name.strip() for name in next(csv.reader([header]))]
+
+    index = [find_column(names, columns["lat"], ("lat",), "latitude"),
+             find_column(names, columns["lon"], ("lon",), "longitude"),
+             find_column(names, columns["alt"], ("alt",), "altitude"),
+             find_column(names, columns["date"], DATE_COLUMNS, "date")]
+
+    yield header
+
+    while True:
+        lines = [line.rstrip("\r\n") for line in islice(stream, chunk_size)]
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+
+        rows = list(csv.reader(lines))
+        fields = list(zip(*rows))
+
+        yield lines, *(np.array(fields[i], dtype=np.float64) for i in index[:3]), parse_dates(fields[index[3]])
+
+
+def read_ndjson_chunks(stream: TextIO, chunk_size: int, columns: dict) -> Iterator:
+    """
+    Read the newline-delimited JSON stream in chunks.
+
+    :param stream: the text stream of JSON objects, one per line
+    :param chunk_size: the number of rows of each chunk
+    :param columns: the keys of lat, lon, alt and date. None for the default keys
+    :return: None for the header, then the raw lines, lat, lon, alt and date columns of each chunk
+    """
+
+    yield None
+
+    keys = None
+    while True:
+        lines = [line.rstrip("\r\n") for line in islice(stream, chunk_size)]
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+
+        rows = [json.loads(line) for line in lines]
+        if keys is None:
+            names = list(rows[0].keys())
+            keys = [names[find_column(names, columns["lat"], ("lat",), "latitude")],
+                    names[find_column(names, columns["lon"], ("lon",), "longitude")],
+                    names[find_column(names, columns["alt"], ("alt",), "altitude")],
+                    names[find_column(names, columns["date"], DATE_COLUMNS, "date")]]
+
+        try:
+            fields = [[row[key] for row in rows] for key in keys]
+        except KeyError as err:
+            raise ValueError(f"Some of the rows are missing the key {err}.")
+
+        yield lines, *(np.array(fields[i], dtype=np.float64) for i in range(3)), parse_dates(fields[3])
+
+
+def format_csv(lines: list, values: np.ndarray, precision: int) -> str:
+    """
+    Append the values to the raw csv lines. The values of the chunk are formatted with one string operation.
+
+    :param lines: the raw input lines
+    :param values: the values in (number of rows, number of elements)
+    :param precision: the number of decimal places
+    :return: the text of the output lines
+    """
+
+    row_fmt = ",".join([f"%.{precision}f"] * values.shape[1]) + "\n"
+    block = (row_fmt * values.shape[0]) % tuple(values.ravel())
+
+    return "\n".join(map(",".join, zip(lines, block.split("\n")))) + "\n"
+
+
+def format_ndjson(lines: list, values: np.ndarray, elements: tuple, precision: int) -> str:
+    """
+    Add the values to the raw JSON objects. The values of the chunk are formatted with one string operation.
+
+    :param lines: the raw input lines
+    :param values: the values in (number of rows, number of elements)
+    :param elements: the names of the magnetic elements
+    :param precision: the number of decimal places
+    :return: the text of the output lines
+    """
+
+    row_fmt = "".join(f', "{key}": %.{precision}f' for key in elements) + "}\n"
+    block = (row_fmt * values.shape[0]) % tuple(values.ravel())
+    objects = [line.rstrip()[:-1] for line in lines]
+
+    return "".join(map("".join, zip(objects, block.splitlines(keepends=True))))
+
+
+def run_batch(inp: TextIO, out: TextIO, elements: tuple, fmt: str = "csv", chunk_size: int = DEFAULT_CHUNK_SIZE,
+              columns: Optional[dict] = None, unit: str = "km", msl: bool = False, precision: int = 6,
+              nmax: int = 12) -> int:
+    """
+    Stream the points from inp, compute the magnetic elements chunk by chunk and write them to out. The memory
+    only depends on the chunk size.
+
+    :param inp: the input text stream
+    :param out: the output text stream
+    :param elements: the names of the magnetic elements
+    :param fmt: default is "csv". "csv" or "ndjson"
+    :param chunk_size: the number of rows computed at once
+    :param columns: the column names of lat, lon, alt and date. None for the default names
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param precision: the number of decimal places of the outputs
+    :param nmax: max degree
+    :return: the number of rows
+    """
+
+    columns = {"lat": None, "lon": None, "alt": None, "date": None, **(columns or {})}
+    reader = read_ndjson_chunks if fmt == "ndjson" else read_csv_chunks
+    chunks = reader(inp, chunk_size, columns)
+
+    header = next(chunks)
+    if fmt == "csv":
+        out.write(header + "," + ",".join(elements) + "\n")
+
+    model = wmm_calc(nmax)
+    num_rows = 0
+
+    for lines, lat, lon, alt, dyear in chunks:
+        try:
+            mag_map = compute_chunk(model, lat, lon, alt, dyear, elements, unit, msl)
+        except ValueError as err:
+            raise ValueError(f"rows {num_rows + 1}-{num_rows + len(lines)}: {err}")
+
+        values = np.column_stack([mag_map[key] for key in elements])
+        if fmt == "ndjson":
+            out.write(format_ndjson(lines, values, elements, precision))
+        else:
+            out.write(format_csv(lines, values, precision))
+
+        num_rows += len(lines)
+
+    return num_rows
+
+
+def open_columns(inp: str, columns: Optional[dict] = None, raw_dtype: str = "<f8") -> list:
+    """
+    Open the input columns with memory mapping, so they are read chunk by chunk without loading the whole file.
+
+    :param inp: one .npy file in the shape of (number of rows, 4) for lat, lon, alt and dyear or with the named
+    fields, or the comma separated paths of four column files. The column files are .npy or raw binary files.
+    :param columns: the field names of lat, lon, alt and date in the structured .npy file. None for the default names
+    :param raw_dtype: default is little-endian float64. The dtype of the raw binary column files.
+    :return: the lat, lon, alt and date columns
+    """
+
+    columns = {"lat": None, "lon": None, "alt": None, "date": None, **(columns or {})}
+
+    def open_file(path: str) -> np.ndarray:
+        if path.lower().endswith(".npy"):
+            return np.load(path, mmap_mode="r")
+        return np.memmap(path, dtype=np.dtype(raw_dtype), mode="r")
+
+    paths = [path.strip() for path in inp.split(",")]
+    if len(paths) == 4:
+        cols = [open_file(path) for path in paths]
+    elif len(paths) == 1:
+        data = open_file(paths[0])
+        if data.dtype.names:
+            names = list(data.dtype.names)
+            cols = [data[names[find_column(names, columns[key], default, label)]] for key, default, label in
+                    [("lat", ("lat",), "latitude"), ("lon", ("lon",), "longitude"), ("alt", ("alt",), "altitude"),
+                     ("date", DATE_COLUMNS, "date")]]
+        elif data.ndim == 2 and data.shape[1] == 4:
+            cols = [data[:, i] for i in range(4)]
+        else:
+            raise ValueError(f"{paths[0]} should be in the shape of (number of rows, 4) or have named fields.")
+    else:
+        raise ValueError("Please provide one .npy file or four column files of lat, lon, alt and dyear.")
+
+    if len({col.shape[0] for col in cols}) != 1 or any(col.ndim != 1 for col in cols):
+        raise ValueError(f"The input columns have different lengths {[col.shape for col in cols]}.")
+
+    return cols
+
+
+def run_npy_batch(cols: list, out_dir: str, elements: tuple, chunk_size: int = DEFAULT_CHUNK_SIZE, unit: str = "km",
+                  msl: bool = False, nmax: int = 12, resume: bool = False, source: str = "") -> int:
+    """
+    Compute the magnetic elements of the columns chunk by chunk and write every element into a memory-mapped
+    <out_dir>/<element>.npy. The last completed chunk is saved in <out_dir>/progress.json after every chunk, so an
+    interrupted run continues from there with resume=True.
+
+    :param cols: the lat, lon, alt and date columns from open_columns()
+    :param out_dir: the output folder
+    :param elements: the names of the magnetic elements
+    :param chunk_size: the number of rows computed at once
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param nmax: max degree
+    :param resume: default is False. Set it to True to continue from the last completed chunk of out_dir.
+    :param source: the description of the inputs. The run is only resumed with the same source.
+    :return: the number of rows
+    """
+
+    num_rows = cols[0].shape[0]
+    os.makedirs(out_dir, exist_ok=True)
+    progress_path = os.path.join(out_dir, PROGRESS_FILE)
+    job = {"source": source, "num_rows": num_rows, "elements": list(elements), "unit": unit, "msl": msl, "nmax": nmax}
+
+    start = 0
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, "r") as fp:
+            progress = json.load(fp)
+        if progress["job"] != job:
+            raise ValueError(f"Can't resume {out_dir}. It was computed for {progress['job']}.")
+        start = progress["completed"]
+
+    mode = "r+" if start > 0 else "w+"
+    outputs = {key: np.lib.format.open_memmap(os.path.join(out_dir, f"{key}.npy"), mode=mode, dtype=np.float64,
+                                              shape=(num_rows,)) for key in elements}
+
+    model = wmm_calc(nmax)
+    for chunk_start in range(start, num_rows, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, num_rows)
+        lat, lon, alt = (np.array(col[chunk_start:chunk_stop], dtype=np.float64) for col in cols[:3])
+        dyear = parse_dates(np.asarray(cols[3][chunk_start:chunk_stop]))
+
+        try:
+            mag_map = compute_chunk(model, lat, lon, alt, dyear, elements, unit, msl)
+        except ValueError as err:
+            raise ValueError(f"rows {chunk_start + 1}-{chunk_stop}: {err}")
+
+        for key in elements:
+            outputs[key][chunk_start:chunk_stop] = mag_map[key]
+            outputs[key].flush()
+
+        tmp_path = progress_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump({"job": job, "completed": chunk_stop}, fp)
+        os.replace(tmp_path, progress_path)
+
+    return num_rows
+
+
+def compute_chunk(model: wmm_calc, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, dyear: np.ndarray,
+                  elements: tuple, unit: str, msl: bool) -> dict:
+    """
+    Compute the magnetic elements of one chunk with the model.
+
+    :param model: the wmm_calc object reused by every chunk
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude in km, meter or feet
+    :param dyear: decimal year
+    :param elements: the names of the magnetic elements
+    :param unit: the unit of altitude
+    :param msl: True if the altitude is the height above mean sea level
+    :return: dict object includes the requested magnetic elements in float64 arrays
+    """
+
+    alt = model.to_km(alt, unit)
+    if msl:
+        alt = util.alt_to_ellipsoid_height(alt, lat, lon)
+    model.setup_env(lat, lon, alt, dyear=dyear)
+    mag_map = model.get_elements(elements)
+
+    return {key: np.asarray(mag_map[key], dtype=np.float64) for key in elements}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--in", dest="inp", default="-",
+                        help="the input csv, ndjson or npy file, or four comma separated column files of lat, lon, "
+                             "alt and dyear. Default is stdin")
+    parser.add_argument("--out", default="-",
+                        help="the output file, or the output folder of npy. Default is stdout")
+    parser.add_argument("--format", choices=["csv", "ndjson", "npy"], default=None,
+                        help="the format of the input and output. Default is from the extension of --in")
+    parser.add_argument("--raw-dtype", default="<f8",
+                        help="the dtype of the raw binary column files. Default is little-endian float64")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the npy batch from the last completed chunk in the output folder")
+    parser.add_argument("--elements", default=",".join(ALL_ELEMENTS),
+                        help="the comma separated magnetic elements. Default is all of them")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="the number of rows computed at once")
+    parser.add_argument("--lat-col", default=None, help="the name of latitude column. Default is lat")
+    parser.add_argument("--lon-col", default=None, help="the name of longitude column. Default is lon")
+    parser.add_argument("--alt-col", default=None, help="the name of altitude column. Default is alt")
+    parser.add_argument("--date-col", default=None,
+                        help=f"the name of decimal year or ISO date column. Default is one of {', '.join(DATE_COLUMNS)}")
+    parser.add_argument("--unit", choices=["km", "m", "feet"], default="km", help="the unit of altitude")
+    parser.add_argument("--msl", action="store_true", help="the altitude is the height above mean sea level")
+    parser.add_argument("--precision", type=int, default=6, help="the number of decimal places of the outputs")
+    parser.add_argument("--warnings", action="store_true", help="show the warnings like the blackout zone")
+
+
+def main(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """
+    Run "python -m wmm batch".
+    """
+
+    elements = [key.strip() for key in args.elements.split(",") if key.strip()]
+    try:
+        # the columns are written in the order of --elements
+        check_elements(elements)
+    except ValueError as err:
+        parser.error(str(err))
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size should be a positive integer")
+
+    fmt = detect_format(args.inp, args.format)
+    columns = {"lat": args.lat_col, "lon": args.lon_col, "alt": args.alt_col, "date": args.date_col}
+
+    if fmt == "npy":
+        if args.inp == "-" or args.out == "-":
+            parser.error("the npy format needs the input files and the output folder")
+        try:
+            with warnings.catch_warnings():
+                if not args.warnings:
+                    warnings.simplefilter("ignore")
+                cols = open_columns(args.inp, columns, args.raw_dtype)
+                run_npy_batch(cols, args.out, tuple(elements), args.chunk_size, args.unit, args.msl,
+                              resume=args.resume, source=args.inp)
+        except (ValueError, KeyError, OSError) as err:
+            parser.exit(1, f"{parser.prog}: error: {err}\n")
+        return
+
+    inp = sys.stdin if args.inp == "-" else open(args.inp, "r", newline="")
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+
+    try:
+        with warnings.catch_warnings():
+            if not args.warnings:
+                warnings.simplefilter("ignore")
+            run_batch(inp, out, tuple(elements), fmt, args.chunk_size, columns, args.unit, args.msl, args.precision)
+    except (ValueError, KeyError) as err:
+        parser.exit(1, f"{parser.prog}: error: {err}\n")
+    except BrokenPipeError:
+        # the reader of stdout is closed, e.g. piped to head
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    finally:
+        if inp is not sys.stdin:
+            inp.close()
+        if out is not sys.stdout:
+            out.close()
@@ -2,12 +2,30 @@ import os
 import warnings
 import math
 import datetime as dt
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import Optional, Tuple, Union
 import numpy as np
 
 from geomaglib import util, legendre, magmath, sh_vars, sh_loader
 from wmm import load
 from wmm import uncertainty
+from wmm import summation
+
+BASE_ELEMENTS = ("x", "y", "z", "h", "f", "dec", "inc")
+SV_ELEMENTS = ("dx", "dy", "dz", "dh", "df", "ddec", "dinc")
+ALL_ELEMENTS = BASE_ELEMENTS + SV_ELEMENTS
+# The max degree of the coefficients of WMM
+MAX_DEGREE = 12
+# The max degree of the secular variation coefficients of WMM, which are used to shift the coefficients in time
+MAX_SV_DEGREE = 12
+# setup_env() only recomputes the changed points if they are at most this fraction of the points
+PARTIAL_UPDATE_FRACTION = 0.25
+# The summation kernels of wmm_calc, see wmm_calc.__init__()
+KERNELS = ("tables", "recursive")
+# The number of points of which the spherical harmonic terms and legendre functions are computed at once in the
+# low memory mode
+LOW_MEMORY_CHUNK_SIZE = 16384
+
 
 def convert_to_ndarray(num: Union[int, float, list, np.ndarray]):
     if np.isscalar(num):
@@ -43,6 +61,165 @@ def fill_timeslot(year: Optional[int], month: Optional[int], day: Optional[int])
     return year, month, day
 
 
+def to_km(alt: np.ndarray, unit: str) -> np.ndarray:
+    """
+    Transform the meter or feet to km
+    :param alt: the altitude in meter or feet or km
+    :param unit: "m" for meter and "feet" or feet, "km" for kilometer
+    :return: the altitude based on km
+    """
+
+    if unit == "km":
+        return alt
+    elif unit == "m":
+        return alt / 1000
+    elif unit == "feet":
+        return alt * 0.0003048
+    else:
+        raise ValueError("Get unknown unit. Please provide km, m or feet.")
+
+
+def unique_rows(*cols: np.ndarray) -> Tuple:
+    """
+    Find the unique rows of the columns. The rows are compared by their bytes, which is much faster than
+    np.unique(axis=0).
+    :param cols: the 1-D float arrays of the same length
+    :return: the index of the first row of every unique row, and the index of the unique row of every row
+    """
+
+    rows = np.ascontiguousarray(np.stack([np.asarray(col, dtype=np.float64) for col in cols], axis=1))
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * len(cols)))).ravel()
+    _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    return index, inverse.ravel()
+
+
+def check_nmax(nmax: int, max_degree: int = MAX_DEGREE) -> int:
+    """
+    Check the max degree of the spherical harmonics.
+
+    :param nmax: max degree
+    :param max_degree: the max degree of the coefficients
+    :return: nmax
+    """
+
+    if not isinstance(nmax, int):
+        raise TypeError(f"Please provide nmax with integer type.")
+    if nmax <= 0 or nmax > max_degree:
+        raise ValueError (f"The degree is not available. Please assign the degree > 0 and degree <= {max_degree}.")
+
+    return nmax
+
+
+def check_elements(elements: Optional[Union[str, list, tuple]]) -> tuple:
+    """
+    Check the names of the magnetic elements.
+
+    :param elements: None for all of the elements, or the name or the list of names of the elements, the keys of get_all()
+    :return: the names of the elements in the order of ALL_ELEMENTS
+    """
+
+    if elements is None:
+        return ALL_ELEMENTS
+    if isinstance(elements, str):
+        elements = [elements]
+    unknown = [key for key in elements if key not in ALL_ELEMENTS]
+    if unknown:
+        raise ValueError(f"Get unknown magnetic elements {unknown}. Please provide elements from {list(ALL_ELEMENTS)}.")
+
+    return tuple(key for key in ALL_ELEMENTS if key in elements)
+
+
+def broadcast_points(*vals: Union[int, float, list, np.ndarray]) -> list:
+    """
+    Convert the coordinates and time to float64 vectors, and broadcast the scalars to the length of the vectors.
+
+    :param vals: e.g. lat, lon, alt and dyear in scalars, lists or numpy arrays
+    :return: the list of float64 vectors with the same length
+    """
+
+    vals = [convert_to_ndarray(val).astype(np.float64).ravel() for val in vals]
+    if any(val.size == 0 for val in vals):
+        raise ValueError("The input time or space vectors are empty. Please provide at least one point.")
+    try:
+        return np.broadcast_arrays(*vals)
+    except ValueError:
+        raise ValueError("The input time and space vectors have different sizes. Please input scalars, or vectors of matching length")
+
+
+def writable_results(mag_map: dict) -> dict:
+    """
+    Copy the read-only cached arrays of wmm_calc in the results, so the callers can modify the returned arrays
+    without changing the cache. The elements derived from the cache are new arrays and are returned as they are.
+
+    :param mag_map: dict object includes the magnetic elements
+    :return: dict object includes the writable magnetic elements
+    """
+
+    return {key: val.copy() if isinstance(val, np.ndarray) and not val.flags.writeable else val
+            for key, val in mag_map.items()}
+
+
+def check_coords(lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, warn: bool = True):
+    """
+    Validify the coordinate provide from user
+    :param lat: latitude in degree
+    :param lon: longtitude in degree
+    :param alt: altitude in km
+    :param warn: default is True. Set it to False to skip the warning of the altitude.
+    """
+
+    if np.any(lat > 90.0) or np.any(lat < -90.0):
+        raise ValueError("latitude should between -90 to 90")
+
+    if np.any(lon > 360.0) or np.any(lon < -180.0):
+        raise ValueError("lontitude should between -180 to 360")
+
+    if warn and (np.any(alt < -1) or np.any(alt > 1900)):
+        link = "\033[94mhttps://www.ncei.noaa.gov/products/world-magnetic-model/accuracy-limitations-error-model\033[0m"  # Blue color
+        warnings.warn(f"Warning: WMM will not meet MilSpec at this altitude. For more information see {link}")
+
+
+def check_time_range(dyear: np.ndarray, coef_dict: dict):
+    """
+    Validify the decimal year provided from user with the valid period of the coefficients
+    :param dyear: decimal year
+    :param coef_dict: the loaded coefficients with epoch, min_year and min_date
+    """
+
+    max_year = coef_dict["epoch"] + 5.0
+
+    if np.any(dyear < coef_dict["min_year"]) or np.any(dyear >= max_year):
+        max_year = round(max_year, 1)
+        raise ValueError(f"Invalid year. Please provide date from {coef_dict['min_date']} to [{int(max_year)}]-[01]-[01] 00:00")
+
+
+def check_blackout_zone(Bx: np.ndarray, By: np.ndarray, Bz: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                        alt: np.ndarray):
+    """
+    Return warning if the location is in balckout zone
+    :param Bx: magnetic elements Bx
+    :param By: magnetic elements By
+    :param Bz: magnetic elements Bz
+    :param lat: latitude in degree of Bx, By and Bz
+    :param lon: longitude in degree of Bx, By and Bz
+    :param alt: altitude in km of Bx, By and Bz
+    """
+
+    h = wmm_elements(Bx, By, Bz).get_Bh()
+    if np.any(h <= 2000.0):
+        problem_index = np.where(h <= 2000.0)
+        warnings.warn(
+            f"Warning: (lat, lon, alt(Ellipsoid Height in km)) = ({lat[problem_index]}, {lon[problem_index]}, {alt[problem_index]}) is in the blackout zone around the magnetic pole as defined by the WMM military specification"
+            " (https://www.ngdc.noaa.gov/geomag/WMM/data/MIL-PRF-89500B.pdf). Compass accuracy is highly degraded in this region.\n")
+    elif np.any(h <= 6000.0):
+        problem_index = np.where(h <= 6000.0)
+        warnings.warn(
+            
+            f"Caution: (lat, lon, alt(Ellipsoid Height in km)) = ({lat[problem_index]}, {lon[problem_index]}, {alt[problem_index]}) is approaching the blackout zone around the magnetic pole as defined by the WMM military specification "
+            "(https://www.ngdc.noaa.gov/geomag/WMM/data/MIL-PRF-89500B.pdf). Compass accuracy may be degraded in this region.\n")
+
+
 class wmm_elements(magmath.GeomagElements):
 
     def __init__(self, Bx: np.ndarray, By: np.ndarray, Bz: np.ndarray, dBx: Optional[np.ndarray] = None, dBy: Optional[np.ndarray] = None,
@@ -94,6 +271,56 @@ class wmm_elements(magmath.GeomagElements):
         return dinc
 
 
+    def get_elements(self, elements: Union[list, tuple]) -> dict:
+        """
+        Get only the requested magnetic elements. The intermediate h, f and dh are computed once and only if one of
+        the requested elements depends on them. The values are the same as get_all().
+        :param elements: the list of element names, e.g. ["dec", "h"]. See ALL_ELEMENTS for the available names.
+        :return: dict object includes the requested magnetic elements in the order of get_all()
+        """
+
+        derived = {}
+
+        def h():
+            if "h" not in derived:
+                derived["h"] = np.asarray(self.get_Bh(), dtype=np.float64)
+            return derived["h"]
+
+        def f():
+            if "f" not in derived:
+                derived["f"] = np.asarray(self.get_Bf(), dtype=np.float64)
+            return derived["f"]
+
+        def dh():
+            if "dh" not in derived:
+                derived["dh"] = (self.Bx * self.dBx + self.By * self.dBy) / h()
+            return derived["dh"]
+
+        compute = {
+            "x": lambda: np.asarray(self.Bx, dtype=np.float64),
+            "y": lambda: np.asarray(self.By, dtype=np.float64),
+            "z": lambda: np.asarray(self.Bz, dtype=np.float64),
+            "h": h,
+            "f": f,
+            "dec": lambda: magmath.rad2deg(np.arctan2(self.By, self.Bx)),
+            "inc": lambda: magmath.rad2deg(np.arctan2(self.Bz, h())),
+            "dx": lambda: self.dBx,
+            "dy": lambda: self.dBy,
+            "dz": lambda: self.dBz,
+            "dh": dh,
+            "df": lambda: (self.Bx * self.dBx + self.By * self.dBy + self.Bz * self.dBz) / f(),
+            "ddec": lambda: 180 / math.pi * (self.Bx * self.dBy - self.By * self.dBx) / (h() ** 2),
+            "dinc": lambda: np.asarray((180 / math.pi * (h() * self.dBz - self.Bz * dh())) / (f() ** 2),
+                                       dtype=np.float64),
+        }
+
+        mag_map = {}
+        for key in ALL_ELEMENTS:
+            if key in elements:
+                mag_map[key] = compute[key]()
+
+        return mag_map
+
     def get_uncertainity(self, err_vals):
 
         h = self.get_Bh()
@@ -118,16 +345,30 @@ class wmm_elements(magmath.GeomagElements):
 
 class wmm_calc():
 
-    def __init__(self, nmax: int=12):
+    def __init__(self, nmax: int=12, dedup: bool = False, kernel: str = "tables", low_memory: bool = False):
         """
         The WMM model class for computing magnetic elements
+        :param nmax: max degree
+        :param dedup: default is False. Set it to True to compute the repeated coordinates only once, see
+        forward_unique().
+        :param kernel: default is "tables". The summation of the spherical harmonics. "tables" keeps the legendre
+        functions and spherical harmonic terms of all of the points in the instance, "recursive" computes them on the
+        fly with summation.mag_SPH_summation_recursive() and only needs a few arrays of the number of points.
+        :param low_memory: default is False. Set it to True to compute the field in chunks of LOW_MEMORY_CHUNK_SIZE
+        points without keeping the spherical harmonic terms and legendre functions in the instance, see
+        forward_chunks().
         """
 
-        self.max_degree = 12
+        if kernel not in KERNELS:
+            raise ValueError(f"Get unknown kernel {kernel}. Please provide kernel from {list(KERNELS)}.")
+        if dedup and low_memory:
+            raise ValueError("dedup and low_memory can't be used together. Please set only one of them.")
+
+        self.max_degree = MAX_DEGREE
 
         self.nmax = self.setup_max_degree(nmax)
         self.max_year = 2030.0
-        self.max_sv = 12
+        self.max_sv = MAX_SV_DEGREE
         self.coef_file = "WMM.COF"
         self.err_vals = uncertainty.err_model
         self.min_date = ""
@@ -141,6 +382,13 @@ class wmm_calc():
         self.theta = None
         self.sph_dict = {}
         self.Leg = []
+        self.results = {}
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.executor = None
+        self.dedup = dedup
+        self.dedup_stats = {}
+        self.kernel = kernel
+        self.low_memory = low_memory
 
     def get_coefs_path(self, filename: str) -> str:
         """
@@ -163,7 +411,7 @@ class wmm_calc():
 
         wmm_coeffs = self.get_coefs_path(self.coef_file)
 
-        return load.load_wmm_coefs(wmm_coeffs, self.nmax)
+        return load.load_wmm_coefs_cached(wmm_coeffs, self.nmax)
 
 
     def to_km(self, alt: np.ndarray, unit: str) -> float:
@@ -175,29 +423,16 @@ class wmm_calc():
         :return: the altitude absed on km
         """
 
-        if unit == "km":
-            return alt
-
-        elif unit == "m":
-            return alt / 1000
-        elif unit == "feet":
-            return alt * 0.0003048
-        else:
-            raise ValueError ("Get unknown unit. Please provide km, m or feet.")
+        return to_km(alt, unit)
 
 
     def setup_max_degree(self, nmax: int):
 
-        if not isinstance(nmax, int):
-            raise TypeError(f"Please provide nmax with integer type.")
-
-        if nmax <= 0 or nmax > self.max_degree:
-            raise ValueError (f"The degree is not available. Please assign the degree > 0 and degree <= {self.max_degree}.")
-        else:
-            return nmax
+        return check_nmax(nmax, self.max_degree)
 
 
-    def setup_env(self, lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray], alt: Union[int, float, list, np.ndarray], unit: str = "km", msl: bool = False):
+    def setup_env(self, lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray], alt: Union[int, float, list, np.ndarray], unit: str = "km", msl: bool = False,
+                  dyear: Union[int, float, list, np.ndarray] = None):
         """
         The function will initialize the radius, geocentric latitude in degree,
         spherical harmonic terms, maximum degree and legendre function for users.If user is not
@@ -209,17 +444,23 @@ class wmm_calc():
         :param alt: altitude in km, meter or feet
         :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
         :param msl: default is True. set it to False if the altitude is ellipsoid height.
+        :param dyear: default is None. The decimal year of the coordinates. It is checked with the new coordinates
+        instead of the previous ones, so the number of points can change together with the time, e.g. for the chunks
+        of a file.
 
         """
         lat = convert_to_ndarray(lat)
         lon = convert_to_ndarray(lon)
         alt = convert_to_ndarray(alt)
+        if dyear is not None:
+            dyear = convert_to_ndarray(dyear)
         
         need_broadcasting = False
         
-        if(not(self.dyear is None)):
+        if(not(self.dyear is None) or dyear is not None):
             
-            lat_size,lon_size, alt_size, dyear_size= np.size(lat),np.size(lon),np.size(alt), np.size(self.dyear)
+            time_size = np.size(self.dyear) if dyear is None else np.size(dyear)
+            lat_size,lon_size, alt_size, dyear_size= np.size(lat),np.size(lon),np.size(alt), time_size
             sizes = np.array([lat_size,lon_size, alt_size, dyear_size])
         
             if(len(np.unique(sizes))>2 ):
@@ -243,16 +484,17 @@ class wmm_calc():
         if(lat_size != lon_size or lat_size != alt_size or alt_size != lon_size or need_broadcasting):
                 
                 #If all values are either max size, or broadcast to match the shape\n of vector inputs')
-                broadcast_template = np.ones(np.max(sizes))
+                #The scalars are broadcast as views, they are only copied once into the instance
+                num_points = np.max(sizes)
                 if(lat_size == 1):
                 #Broadcast scalar variable to vector length
-                    lat = broadcast_template*lat[0] 
+                    lat = np.broadcast_to(lat.astype(np.float64), num_points)
                 if(lon_size == 1):
                 #Broadcast scalar variable to vector length
-                    lon = broadcast_template*lon[0] 
+                    lon = np.broadcast_to(lon.astype(np.float64), num_points)
                 if(alt_size == 1):
                 #Broadcast scalar variable to vector length
-                    alt = broadcast_template*alt[0] 
+                    alt = np.broadcast_to(alt.astype(np.float64), num_points)
             #Check if time exists and potentially broadcast it
         """beginning to set up case 2 w time/space"""
         # if(self.dyear is not None):
@@ -293,23 +535,234 @@ class wmm_calc():
                 self.alt = alt
                 self.lon = lon
                 self.lat = lat
-                self.sph_dict = sh_vars.comp_sh_vars(lon, self.r, self.theta, self.nmax)
+                self.reset_sh_terms()
         #Set r and theta values
-        if (np.any(lat != self.lat) or np.any(lon != self.lon) or np.any(alt != self.alt)):
+        if self.lat is None or self.r is None:
+            changed = np.ones(np.size(lat), dtype=bool)
+        else:
+            changed = (lat != self.lat) | (lon != self.lon) | (alt != self.alt)
+        num_changed = np.count_nonzero(changed)
 
+        if num_changed > PARTIAL_UPDATE_FRACTION * changed.size:
             self.r, self.theta = util.geod_to_geoc_lat(lat, alt)
             self.r = np.array(self.r)
             self.theta = np.array(self.theta)
-            self.sph_dict = sh_vars.comp_sh_vars(lon, self.r, self.theta, self.nmax)
+            self.reset_sh_terms()
+        elif num_changed > 0:
+            rows = np.flatnonzero(changed)
+            self.patch_points(rows, lat[rows], lon[rows], alt[rows])
 
         self.lat = np.array(lat)
         self.lon = np.array(lon)
         self.alt = np.array(alt)
-        cotheta = 90.0 - self.theta
 
+        if dyear is not None:
+            self.setup_time(dyear=dyear)
 
+    def update_points(self, indices: Union[int, list, np.ndarray], lat: Union[int, float, list, np.ndarray],
+                      lon: Union[int, float, list, np.ndarray], alt: Union[int, float, list, np.ndarray],
+                      unit: str = "km", msl: bool = False):
+        """
+        Move some of the points of setup_env(). Only the geometry and the computed magnetic vectors of the moved
+        points are recomputed, and the rest of the points are left as they are.
 
-        self.Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, cotheta)
+        :param indices: the indices of the moved points
+        :param lat: the new latitude in degree
+        :param lon: the new longtitude in degree
+        :param alt: the new altitude in km, meter or feet
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+        """
+
+        if self.lat is None or self.lon is None or self.alt is None:
+            raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
+
+        rows = convert_to_ndarray(indices).ravel()
+        if not np.issubdtype(rows.dtype, np.integer):
+            raise TypeError("Please provide indices with integer type.")
+        if np.any(rows < -self.lat.size) or np.any(rows >= self.lat.size):
+            raise ValueError(f"The indices are out of the {self.lat.size} points.")
+        rows = np.mod(rows, self.lat.size)
+
+        try:
+            lat, lon, alt = [np.broadcast_to(convert_to_ndarray(val).astype(np.float64).ravel(), rows.shape)
+                             for val in (lat, lon, alt)]
+        except ValueError:
+            raise ValueError("The indices and the coordinates have different sizes. Please input scalars, or vectors of matching length")
+
+        alt = self.to_km(alt, unit)
+        if msl:
+            alt = util.alt_to_ellipsoid_height(alt, lat, lon)
+        self.check_coords(lat, lon, alt)
+
+        self.patch_points(rows, lat, lon, alt)
+
+    def patch_points(self, rows: np.ndarray, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray):
+        """
+        Recompute the geometry and the cached magnetic vectors of the rows and write them into the arrays of the
+        instance. The arrays shared with the callers or set read-only are copied before they are written.
+
+        :param rows: the indices of the points
+        :param lat: the new latitude in degree
+        :param lon: the new longtitude in degree
+        :param alt: the new ellipsoid height in km
+        """
+
+        # the rows are written in ascending order, which is much faster for the large arrays
+        order = np.argsort(rows, kind="stable")
+        rows, lat, lon, alt = rows[order], lat[order], lon[order], alt[order]
+
+        def patch(arr, vals):
+            if not isinstance(arr, np.ndarray) or not arr.flags.writeable:
+                arr = np.array(arr, dtype=np.float64)
+            arr[..., rows] = vals
+            return arr
+
+        r, theta = util.geod_to_geoc_lat(lat, alt)
+        r, theta = np.array(r), np.array(theta)
+
+        self.lat, self.lon, self.alt = patch(self.lat, lat), patch(self.lon, lon), patch(self.alt, alt)
+        self.r, self.theta = patch(self.r, r), patch(self.theta, theta)
+
+        sph_dict, Leg = {}, []
+        if self.sph_dict or len(self.Leg) > 0 or (self.low_memory and self.kernel != "recursive"):
+            sph_dict = sh_vars.comp_sh_vars(lon, r, theta, self.nmax)
+            Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, 90.0 - theta)
+        if self.sph_dict:
+            # the constant terms like cos_mlon[0] are scalars
+            self.sph_dict = {name: [term if np.ndim(term) == 0 else patch(term, sph_dict[name][i])
+                                    for i, term in enumerate(terms)] for name, terms in self.sph_dict.items()}
+        if len(self.Leg) > 0:
+            self.Leg = [[patch(term, vals) for term, vals in zip(self.Leg[i], Leg[i])] for i in range(2)]
+
+        results, self.results = self.results, {}
+        if not sph_dict and self.kernel != "recursive":
+            return
+
+        def synthesize(coef_dict, sv=True):
+            return self.synthesize_points(coef_dict, lat, lon, r, theta, sph_dict, Leg, sv)
+
+        rows_vec = {}
+        if "epoch" in results or ("all" in results and np.size(self.dyear) > 1):
+            rows_vec["epoch"] = synthesize(self.coef_dict)
+        if "all" in results:
+            if np.size(self.dyear) > 1:
+                rows_vec["all"] = self.combine_dates(rows_vec["epoch"], self.dyear[rows])
+            else:
+                rows_vec["all"] = synthesize(self.timly_coef_dict)
+        if "base" in results:
+            rows_vec["base"] = synthesize(self.timly_coef_dict, sv=False)[:3]
+
+        if "base" in rows_vec or "all" in rows_vec:
+            self.check_blackout_zone(*rows_vec.get("base", rows_vec.get("all"))[:3], coords=(lat, lon, alt))
+
+        # the elements are derived from the vectors again when they are requested
+        for key, vals in rows_vec.items():
+            self.write_results(key, tuple(patch(vec, val) for vec, val in zip(results[key], vals)))
+
+    def setup_points(self, points):
+        """
+        Use the geometry of PreparedPoints instead of computing it in setup_env(). The coordinates, radius,
+        geocentric latitude, spherical harmonic terms and legendre functions are taken from the object as they are.
+        The recursive kernel only takes the coordinates, radius and geocentric latitude.
+
+        :param points: PreparedPoints object from wmm.prepared.prepare() with the same nmax as the model
+        """
+
+        if points.nmax != self.nmax:
+            raise ValueError(f"The points are prepared for nmax {points.nmax}. Please prepare them with nmax {self.nmax}.")
+        if self.dyear is not None and np.size(self.dyear) > 1 and np.size(self.dyear) != len(points):
+            raise ValueError(f"The input time and space vectors have different sizes of time size: {np.size(self.dyear)}, position size: {len(points)}, input scalars, or vectors of matching length")
+
+        self.lat, self.lon, self.alt = points.lat, points.lon, points.alt
+        self.r, self.theta = points.r, points.theta
+        if self.kernel == "recursive":
+            self.sph_dict, self.Leg = {}, []
+        else:
+            self.sph_dict = points.sph_dict
+            self.Leg = points.Leg
+        self.clear_results()
+
+    def reset_sh_terms(self):
+        """
+        Drop the spherical harmonic terms and legendre functions of the previous coordinates. They will be
+        rebuilt by setup_sh_terms() the next time the magnetic field is computed.
+        """
+
+        self.sph_dict = {}
+        self.Leg = []
+        self.clear_results()
+
+    def clear_results(self, time_only: bool = False):
+        """
+        Drop the cached magnetic vectors and elements. It is called whenever the coordinates or time are changed.
+        :param time_only: default is False. If True, the results which don't depend on the time are kept.
+        """
+
+        if time_only and "epoch" in self.results:
+            self.results = {"epoch": self.results["epoch"]}
+        else:
+            self.results = {}
+
+    def read_results(self, key: str):
+        """
+        Look up the cached results and count the cache hits. The misses are counted whenever the field is summed up.
+        :param key: "base" for (Bx, By, Bz), "all" for (Bx, By, Bz, dBx, dBy, dBz), "epoch" for the field at epoch
+        and secular variation, "elements" and "sv_elements" for wmm_elements
+        :return: the cached results or None if they haven't been computed
+        """
+
+        if key in self.results:
+            self.cache_stats["hits"] += 1
+            return self.results[key]
+
+        return None
+
+    def write_results(self, key: str, vals):
+        """
+        Save the computed results. The cached arrays are set read-only, and the public getters like get_Bx(),
+        forward_all() and get_all() return copies of them, so the cache won't be modified by the callers.
+        :param key: the key of results. See read_results()
+        :param vals: the tuple of magnetic vectors or the wmm_elements object
+        :return: the saved results
+        """
+
+        if isinstance(vals, tuple):
+            for val in vals:
+                if isinstance(val, np.ndarray):
+                    val.setflags(write=False)
+
+        self.results[key] = vals
+
+        return vals
+
+    def setup_sh_terms(self):
+        """
+        Compute the spherical harmonic terms and the legendre functions for all of the coordinates
+        if they haven't been computed since the last setup_env().
+        """
+
+        if not self.sph_dict:
+            self.sph_dict = sh_vars.comp_sh_vars(self.lon, self.r, self.theta, self.nmax)
+        if len(self.Leg) == 0:
+            cotheta = 90.0 - self.theta
+            self.Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, cotheta)
+
+    @property
+    def timly_coef_dict(self) -> dict:
+        """
+        The coefficients timely shifted to dyear. If dyear is a vector, g and h are (number of coefficients, number
+        of dates) arrays, which are computed on the first access since the field is combined from the field at epoch
+        and secular variation.
+        """
+
+        if self._timly_coef_dict is None:
+            self._timly_coef_dict = load.timely_modify_magnetic_model(self.coef_dict, self.dyear, self.max_sv)
+        return self._timly_coef_dict
+
+    @timly_coef_dict.setter
+    def timly_coef_dict(self, coef_dict: Optional[dict]):
+        self._timly_coef_dict = coef_dict
 
     def setup_time(self, year: Union[int, float, list, np.ndarray] = None, month: Union[int, float, list, np.ndarray] = None, day: Union[int, float, list, np.ndarray] = None,
                    dyear: Union[int, float, list, np.ndarray] = None):
@@ -378,13 +831,12 @@ class wmm_calc():
                     #If vectors have different lengths
                     if(np.max(pos_sizes) != np.max(sizes)):
                         raise ValueError(f"The input time and space vectors have different sizes of time size: {np.max(sizes)}, position size: {np.max(pos_sizes)}, input scalars, or vectors of matching length")
-                else:#position is scalar
+                elif np.max(pos_sizes) == 1:#position is scalar
                     #broadcast position
                     
-                    broadcast_template = np.ones(np.max(sizes))
-                    self.lat = broadcast_template*self.lat
-                    self.lon = broadcast_template*self.lon
-                    self.alt = broadcast_template*self.alt
+                    self.lat = np.broadcast_to(self.lat.astype(np.float64), np.max(sizes))
+                    self.lon = np.broadcast_to(self.lon.astype(np.float64), np.max(sizes))
+                    self.alt = np.broadcast_to(self.alt.astype(np.float64), np.max(sizes))
                     
                     self.setup_env(self.lat, self.lon, self.alt)
                     lat_size,lon_size, alt_size= np.size(self.lat),np.size(self.lon),np.size(self.alt)
@@ -392,8 +844,26 @@ class wmm_calc():
                     self.r, self.theta = util.geod_to_geoc_lat(self.lat,self.alt)
                     self.r = np.array(self.r)
                     self.theta = np.array(self.theta)
-                    self.sph_dict = sh_vars.comp_sh_vars(self.lon, self.r, self.theta, self.nmax)
+                    self.reset_sh_terms()
                     
+        self.check_time(curr_dyear)
+
+        if self.dyear is None or np.shape(curr_dyear) != np.shape(self.dyear) or np.any(curr_dyear != self.dyear):
+            self.dyear = curr_dyear
+            self.clear_results(time_only=True)
+            if np.size(self.dyear) > 1:
+                # The field of every date is combined from the field at epoch and secular variation,
+                # so the coefficients of every date are only computed if timly_coef_dict is accessed.
+                self.timly_coef_dict = None
+            else:
+                self.timly_coef_dict = load.timely_modify_magnetic_model(self.coef_dict, self.dyear, self.max_sv)
+
+    def check_time(self, dyear: np.ndarray):
+        """
+        Load the coefficients if they haven't been loaded, and validify the decimal year provided from user
+        :param dyear: decimal year
+        """
+
         if not self.coef_dict:
             self.coef_dict = self.load_coeffs()
         elif self.coef_dict == {}:
@@ -402,14 +872,7 @@ class wmm_calc():
         self.max_year = self.coef_dict["epoch"] + 5.0
         self.min_date = self.coef_dict["min_date"]
 
-
-        if np.any(curr_dyear < self.coef_dict["min_year"]) or np.any(curr_dyear >= self.max_year):
-            max_year = round(self.max_year, 1)
-            raise ValueError(f"Invalid year. Please provide date from {self.min_date} to [{int(max_year)}]-[01]-[01] 00:00")
-
-        if np.any(curr_dyear != self.dyear):
-            self.dyear = curr_dyear
-            self.timly_coef_dict = load.timely_modify_magnetic_model(self.coef_dict, self.dyear, self.max_sv)
+        check_time_range(dyear, self.coef_dict)
 
     def check_coords(self, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray):
         """
@@ -420,38 +883,25 @@ class wmm_calc():
         :return:
         """
 
-        if np.any(lat > 90.0) or np.any(lat < -90.0):
-            raise ValueError("latitude should between -90 to 90")
-
-        if np.any(lon > 360.0) or np.any(lon < -180.0):
-            raise ValueError("lontitude should between -180 to 360")
+        check_coords(lat, lon, alt)
 
-        if np.any(alt < -1) or np.any(alt > 1900):
-            link = "\033[94mhttps://www.ncei.noaa.gov/products/world-magnetic-model/accuracy-limitations-error-model\033[0m"  # Blue color
-            warnings.warn(f"Warning: WMM will not meet MilSpec at this altitude. For more information see {link}")
-
-    def check_blackout_zone(self, Bx: np.ndarray, By: np.ndarray, Bz: np.ndarray):
+    def check_blackout_zone(self, Bx: np.ndarray, By: np.ndarray, Bz: np.ndarray, index: slice = slice(None),
+                            coords: Optional[Tuple] = None):
         """
         Return warning if the location is in balckout zone
         :param Bx: magnetic elements Bx
         :param By: magnetic elements By
         :param Bz: magnetic elements Bz
+        :param index: the slice of the coordinates which Bx, By and Bz were computed for. Default is all of them.
+        :param coords: default is None. The (lat, lon, alt) arrays of Bx, By and Bz if they are not computed for the
+        coordinates of setup_env().
 
         """
 
-        wmm_calc = wmm_elements(Bx, By, Bz)
-        h = wmm_calc.get_Bh()
-        if np.any(h <= 2000.0):
-            problem_index = np.where(h <= 2000.0)
-            warnings.warn(
-                f"Warning: (lat, lon, alt(Ellipsoid Height in km)) = ({self.lat[problem_index]}, {self.lon[problem_index]}, {self.alt[problem_index]}) is in the blackout zone around the magnetic pole as defined by the WMM military specification"
-                " (https://www.ngdc.noaa.gov/geomag/WMM/data/MIL-PRF-89500B.pdf). Compass accuracy is highly degraded in this region.\n")
-        elif np.any(h <= 6000.0):
-            problem_index = np.where(h <= 6000.0)
-            warnings.warn(
-                
-                f"Caution: (lat, lon, alt(Ellipsoid Height in km)) = ({self.lat[problem_index]}, {self.lon[problem_index]}, {self.alt[problem_index]}) is approaching the blackout zone around the magnetic pole as defined by the WMM military specification "
-                "(https://www.ngdc.noaa.gov/geomag/WMM/data/MIL-PRF-89500B.pdf). Compass accuracy may be degraded in this region.\n")
+        if coords is None:
+            coords = self.lat[index], self.lon[index], self.alt[index]
+
+        check_blackout_zone(Bx, By, Bz, *coords)
 
     def forward_base(self) -> Tuple:
         """
@@ -460,41 +910,308 @@ class wmm_calc():
         :return: magnetic elements Bx, By and Bz in geodetic degree
         """
 
+        return tuple(vec.copy() for vec in self.cached_base())
+
+    def forward_sv(self) -> Tuple:
+        """
+        Compute the magnetic elements dBx, dBy and dBz in geodetic degree. If users didn't assign the time by setup_time(), it will
+        use the current time as default.
+        :return: magnetic elements dBx, dBy and dBz in geodetic degree
+        """
+
+        return tuple(vec.copy() for vec in self.cached_sv())
+
+    def forward_all(self) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By, Bz and dBx, dBy, dBz in geodetic degree with one summation pass over
+        the main field and secular variation coefficients.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        return tuple(vec.copy() for vec in self.cached_all())
+
+    def forward_epoch(self) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By, Bz at the epoch of the model and dBx, dBy, dBz in geodetic degree.
+        :return: magnetic elements Bx, By, Bz at the epoch and dBx, dBy, dBz in geodetic degree
+        """
+
+        return tuple(vec.copy() for vec in self.cached_epoch())
+
+    def cached_base(self) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By and Bz in geodetic degree. If users didn't assinn the time by setup_time(), it will
+        use the current time as default.
+        :return: magnetic elements Bx, By and Bz in geodetic degree, the read-only cached arrays
+        """
+
         if self.lat is None or self.lon is None or self.alt is None:
             raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
         
         
         # if self.timly_coef_dict == {}:
-        if not self.timly_coef_dict:
+        if self.dyear is None:
             self.setup_time()
-        Bt, Bp, Br = magmath.mag_SPH_summation(self.nmax, self.sph_dict, self.timly_coef_dict["g"],
-                                               self.timly_coef_dict["h"], self.Leg, self.theta)
-        Bx, By, Bz = magmath.rotate_magvec(Bt, Bp, Br, self.theta, self.lat)
+
+        results = self.read_results("base")
+        if results is not None:
+            return results
+        if "all" in self.results or np.size(self.dyear) > 1:
+            return self.cached_all()[:3]
+
+        self.cache_stats["misses"] += 1
+        Bx, By, Bz, dBx, dBy, dBz = self.synthesize(self.timly_coef_dict, sv=False)
 
         self.check_blackout_zone(Bx, By, Bz)
 
-        return Bx, By, Bz
+        if dBx is None:
+            return self.write_results("base", (Bx, By, Bz))
+        # the secular variation came along with the main field, so it is kept for the next request
+        return self.write_results("all", (Bx, By, Bz, dBx, dBy, dBz))[:3]
 
-    def forward_sv(self) -> Tuple:
+    def cached_sv(self) -> Tuple:
 
         """
         Compute the magnetic elements dBx, dBy and dBz in geodetic degree. If users didn't assign the time by setup_time(), it will
         use the current time as default.
-        :return: magnetic elements dBx, dBy and dBz in geodetic degree
+        :return: magnetic elements dBx, dBy and dBz in geodetic degree, the read-only cached arrays
         """
         if self.lat is None or self.lon is None or self.alt is None:
             raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
-        if self.timly_coef_dict == {}:
+        if self.dyear is None:
             
             self.setup_time()
 
-        dBt, dBp, dBr = magmath.mag_SPH_summation(self.nmax, self.sph_dict, self.timly_coef_dict["g_sv"],
-                                                  self.timly_coef_dict["h_sv"], self.Leg, self.theta)
+        if np.size(self.dyear) > 1 and "all" not in self.results:
+            return self.cached_epoch()[3:]
 
-        dBx, dBy, dBz = magmath.rotate_magvec(dBt, dBp, dBr, self.theta, self.lat)
-        
+        # the main field costs little more in the same pass and is kept for the next request
+        return self.cached_all()[3:]
+
+    def cached_all(self) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By, Bz and dBx, dBy, dBz in geodetic degree with one summation pass over
+        the main field and secular variation coefficients. If users didn't assign the time by setup_time(), it will
+        use the current time as default.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree, the read-only cached arrays
+        """
+        if self.lat is None or self.lon is None or self.alt is None:
+            raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
+        if self.dyear is None:
+            self.setup_time()
+
+        results = self.read_results("all")
+        if results is not None:
+            return results
+
+        if np.size(self.dyear) > 1:
+            Bx, By, Bz, dBx, dBy, dBz = self.combine_dates(self.cached_epoch(), self.dyear)
+        else:
+            self.cache_stats["misses"] += 1
+            Bx, By, Bz, dBx, dBy, dBz = self.synthesize(self.timly_coef_dict)
+
+        if "base" not in self.results:
+            self.check_blackout_zone(Bx, By, Bz)
+
+        return self.write_results("all", (Bx, By, Bz, dBx, dBy, dBz))
+
+    def cached_epoch(self) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By, Bz at the epoch of the model and dBx, dBy, dBz in geodetic degree.
+        The coefficients are linear in time, so the field at any date is B(epoch) + (dyear - epoch) * dB.
+        :return: magnetic elements Bx, By, Bz at the epoch and dBx, dBy, dBz in geodetic degree, the read-only cached
+        arrays
+        """
+
+        if self.lat is None or self.lon is None or self.alt is None:
+            raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
+        if not self.coef_dict:
+            self.coef_dict = self.load_coeffs()
+
+        results = self.read_results("epoch")
+        if results is not None:
+            return results
+
+        self.cache_stats["misses"] += 1
+
+        return self.write_results("epoch", self.synthesize(self.coef_dict))
+
+    def synthesize(self, coef_dict: dict, sv: bool = True) -> Tuple:
+        """
+        Sum up the field of all of the points. It is the only place to choose how the field is computed: the repeated
+        coordinates are computed once with forward_unique() if dedup is set, the points are computed in chunks with
+        forward_chunks() if low_memory is set and the tables haven't been built, otherwise all of the points are
+        computed at once with the kernel of the instance.
+        :param coef_dict: the time modified coefficients, or the coefficients at epoch for many dates
+        :param sv: default is True. If False, the secular variation may be skipped, and dBx, dBy and dBz are None
+        when it is.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        if self.dedup:
+            return self.forward_unique(coef_dict)
+        if self.low_memory and not self.sph_dict:
+            return self.forward_chunks(coef_dict)
+
+        if self.kernel != "recursive":
+            self.setup_sh_terms()
+
+        return self.synthesize_points(coef_dict, self.lat, self.lon, self.r, self.theta, self.sph_dict, self.Leg, sv)
+
+    def synthesize_points(self, coef_dict: dict, lat: np.ndarray, lon: np.ndarray, r: np.ndarray, theta: np.ndarray,
+                          sph_dict: Optional[dict] = None, Leg: Optional[list] = None, sv: bool = True) -> Tuple:
+        """
+        Sum up the field of the given points with the kernel of the instance. The tables kernel builds the spherical
+        harmonic terms and legendre functions of the points if they are not given, the recursive kernel ignores them.
+        :param coef_dict: the time modified coefficients, or the coefficients at epoch for many dates
+        :param lat: geodetic latitude in degree
+        :param lon: longitude in degree
+        :param r: the distance in km from the center of the Earth
+        :param theta: geocentric latitude in degree
+        :param sph_dict: the spherical harmonic terms of the points
+        :param Leg: the legendre functions of the points
+        :param sv: default is True. If False, the tables kernel skips the secular variation and dBx, dBy and dBz are
+        None. The recursive kernel always sums both up in one pass.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        if self.kernel == "recursive":
+            return self.synthesize_recursive(coef_dict, lon, r, theta, lat)
+
+        if not sph_dict:
+            sph_dict = sh_vars.comp_sh_vars(lon, r, theta, self.nmax)
+        if Leg is None or len(Leg) == 0:
+            Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, 90.0 - theta)
+
+        return self.synthesize_tables(sph_dict, Leg, coef_dict, theta, lat, sv)
+
+    def forward_unique(self, coef_dict: dict) -> Tuple:
+        """
+        Compute the magnetic vectors of the unique (lat, lon, alt) points only and scatter them back to the rows in
+        the input order. Within the unique points, the radius terms and legendre functions are computed for the
+        unique (lat, alt) pairs and cos_m(lon) and sin_m(lon) for the unique longitudes, or on the fly by the
+        recursive kernel. The numbers of rows of every stage are saved in dedup_stats.
+        :param coef_dict: the time modified coefficients, or the coefficients at epoch for many dates
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        point_idx, point_inv = unique_rows(self.lat, self.lon, self.alt)
+        lat, lon, alt = self.lat[point_idx], self.lon[point_idx], self.alt[point_idx]
+
+        pair_idx, pair_inv = unique_rows(lat, alt)
+        lon_vals, lon_inv = np.unique(lon, return_inverse=True)
+
+        r, theta = util.geod_to_geoc_lat(lat[pair_idx], alt[pair_idx])
+        r, theta = np.array(r), np.array(theta)
+
+        sph_dict, Leg = {}, []
+        if self.kernel != "recursive":
+            rel_radius = sh_vars.comp_sh_vars(0.0, r, theta, self.nmax)["relative_radius_power"]
+            Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, 90.0 - theta)
+            sph_lon = sh_vars.comp_sh_vars(lon_vals, 1.0, 0.0, self.nmax)
+
+            # expand the terms of the pairs and longitudes to the unique points
+            sph_dict = {
+                "relative_radius_power": [term[pair_inv] for term in rel_radius],
+                "cos_mlon": [term if np.ndim(term) == 0 else term[lon_inv] for term in sph_lon["cos_mlon"]],
+                "sin_mlon": [term if np.ndim(term) == 0 else term[lon_inv] for term in sph_lon["sin_mlon"]],
+            }
+            Leg = [np.asarray(Leg[0])[:, pair_inv], np.asarray(Leg[1])[:, pair_inv]]
+
+        vec = self.synthesize_points(coef_dict, lat, lon, r[pair_inv], theta[pair_inv], sph_dict, Leg)
+
+        num_rows = self.lat.size
+        self.dedup_stats = {
+            "rows": num_rows,
+            "points": lat.size,
+            "lat_alt_pairs": r.size,
+            "lons": lon_vals.size,
+            # the fraction of the summation skipped, which is the most of the work
+            "saved": 1.0 - lat.size / num_rows if num_rows else 0.0,
+        }
+
+        return tuple(val[point_inv] for val in vec)
+
+    def combine_dates(self, epoch_vec: Tuple, dyear: np.ndarray) -> Tuple:
+        """
+        Get the magnetic elements of every point at its own date from the field at epoch and secular variation
+        :param epoch_vec: magnetic elements Bx, By, Bz at the epoch and dBx, dBy, dBz from cached_epoch()
+        :param dyear: decimal year of every point
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
 
-        return dBx, dBy, dBz
+        Bx, By, Bz, dBx, dBy, dBz = epoch_vec
+        date_diff = dyear - self.coef_dict["epoch"]
+
+        # the products are written into the outputs, so there is no temporary array of every component
+        vec = []
+        for B, dB in ((Bx, dBx), (By, dBy), (Bz, dBz)):
+            val = np.multiply(date_diff, dB)
+            val += B
+            vec.append(val)
+
+        return vec[0], vec[1], vec[2], dBx, dBy, dBz
+
+    def get_mag_elements(self, sv: bool = False) -> wmm_elements:
+        """
+        Get the wmm_elements object of the current coordinates and time. It is cached until the coordinates or time
+        are changed, and its vectors are the read-only cached arrays.
+        :param sv: default is False. Set it to True if the secular variation elements are needed.
+        :return: wmm_elements object
+        """
+
+        key = "sv_elements" if sv else "elements"
+        if key in self.results:
+            self.cache_stats["hits"] += 1
+            return self.results[key]
+
+        if sv:
+            mag_vec = wmm_elements(*self.cached_all())
+        elif "sv_elements" in self.results:
+            mag_vec = self.results["sv_elements"]
+        else:
+            mag_vec = wmm_elements(*self.cached_base())
+
+        return self.write_results(key, mag_vec)
+
+    def synthesize_tables(self, sph_dict: dict, Leg: list, coef_dict: dict, theta: np.ndarray, lat: np.ndarray,
+                          sv: bool = True) -> Tuple:
+        """
+        Sum up the main field and secular variation from the tables of the points and rotate them to geodetic.
+        :param sph_dict: the spherical harmonic terms of the points
+        :param Leg: the legendre functions of the points
+        :param coef_dict: the time modified coefficients
+        :param theta: geocentric latitude in degree
+        :param lat: geodetic latitude in degree
+        :param sv: default is True. If False, the secular variation is skipped and dBx, dBy and dBz are None. The
+        main field is the same either way.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        Bt, Bp, Br, dBt, dBp, dBr = summation.mag_SPH_summation_sv(self.nmax, sph_dict, coef_dict["g"],
+                                                                   coef_dict["h"], coef_dict["g_sv"],
+                                                                   coef_dict["h_sv"], Leg, theta, sv)
+
+        return summation.rotate_magvec_sv(Bt, Bp, Br, dBt, dBp, dBr, theta, lat)
+
+    def synthesize_recursive(self, coef_dict: dict, lon: np.ndarray, r: np.ndarray, theta: np.ndarray,
+                             lat: np.ndarray) -> Tuple:
+        """
+        Sum up the main field and secular variation like synthesize_tables(), but the legendre functions and spherical
+        harmonic terms are computed on the fly instead of being read from the tables.
+        :param coef_dict: the time modified coefficients
+        :param lon: longitude in degree
+        :param r: the distance in km from the center of the Earth
+        :param theta: geocentric latitude in degree
+        :param lat: geodetic latitude in degree
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        Bt, Bp, Br, dBt, dBp, dBr = summation.mag_SPH_summation_recursive(self.nmax, lon, r, theta, coef_dict["g"],
+                                                                          coef_dict["h"], coef_dict["g_sv"],
+                                                                          coef_dict["h_sv"])
+
+        return summation.rotate_magvec_sv(Bt, Bp, Br, dBt, dBp, dBr, theta, lat)
 
     def get_Bx(self) -> float:
         """
@@ -502,9 +1219,7 @@ class wmm_calc():
         :return: Bx
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        return Bx
+        return self.cached_base()[0].copy()
 
     def get_By(self) -> float:
         """
@@ -512,9 +1227,7 @@ class wmm_calc():
         :return: By
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        return By
+        return self.cached_base()[1].copy()
 
     def get_Bz(self) -> float:
         """
@@ -522,9 +1235,7 @@ class wmm_calc():
         :return: Bz
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        return Bz
+        return self.cached_base()[2].copy()
 
     def get_Bh(self) -> float:
         """
@@ -532,9 +1243,7 @@ class wmm_calc():
         :return: horizontal magnetic elements in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        mag_vec = wmm_elements(Bx, By, Bz)
+        mag_vec = self.get_mag_elements()
 
         return mag_vec.get_Bh()
 
@@ -544,8 +1253,7 @@ class wmm_calc():
         :return: total intensity in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-        mag_vec = wmm_elements(Bx, By, Bz)
+        mag_vec = self.get_mag_elements()
 
         return mag_vec.get_Bf()
 
@@ -555,9 +1263,7 @@ class wmm_calc():
         :return: declination in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        mag_vec = wmm_elements(Bx, By, Bz)
+        mag_vec = self.get_mag_elements()
 
         return mag_vec.get_Bdec()
 
@@ -567,9 +1273,7 @@ class wmm_calc():
         :return: By
         """
 
-        Bx, By, Bz = self.forward_base()
-
-        mag_vec = wmm_elements(Bx, By, Bz)
+        mag_vec = self.get_mag_elements()
 
         return mag_vec.get_Binc()
 
@@ -580,9 +1284,7 @@ class wmm_calc():
         """
 
 
-        dBx, dBy, dBz = self.forward_sv()
-
-        return dBx
+        return self.cached_sv()[0].copy()
 
     def get_dBy(self) -> float:
         """
@@ -590,9 +1292,7 @@ class wmm_calc():
         :return: By
         """
 
-        dBx, dBy, dBz = self.forward_sv()
-
-        return dBy
+        return self.cached_sv()[1].copy()
 
     def get_dBz(self) -> float:
         """
@@ -600,9 +1300,7 @@ class wmm_calc():
         :return: Bz
         """
 
-        dBx, dBy, dBz = self.forward_sv()
-
-        return dBz
+        return self.cached_sv()[2].copy()
 
     def get_dBh(self) -> float:
         """
@@ -610,10 +1308,7 @@ class wmm_calc():
         :return: delta horizontal in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-        dBx, dBy, dBz = self.forward_sv()
-
-        mag_vec = wmm_elements(Bx, By, Bz, dBx, dBy, dBz)
+        mag_vec = self.get_mag_elements(sv=True)
 
         return mag_vec.get_dBh()
 
@@ -623,10 +1318,7 @@ class wmm_calc():
         :return: delta total intensity in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-        dBx, dBy, dBz = self.forward_sv()
-
-        mag_vec = wmm_elements(Bx, By, Bz, dBx, dBy, dBz)
+        mag_vec = self.get_mag_elements(sv=True)
 
         return mag_vec.get_dBf()
 
@@ -636,10 +1328,7 @@ class wmm_calc():
         :return: delta declination in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-        dBx, dBy, dBz = self.forward_sv()
-
-        mag_vec = wmm_elements(Bx, By, Bz, dBx, dBy, dBz)
+        mag_vec = self.get_mag_elements(sv=True)
 
         return mag_vec.get_dBdec()
 
@@ -649,35 +1338,352 @@ class wmm_calc():
         :return: delta inclination in float type
         """
 
-        Bx, By, Bz = self.forward_base()
-        dBx, dBy, dBz = self.forward_sv()
-
-        mag_vec = wmm_elements(Bx, By, Bz, dBx, dBy, dBz)
+        mag_vec = self.get_mag_elements(sv=True)
 
         return mag_vec.get_dBinc()
 
-    def get_all(self) -> dict:
+    def get_chunk_size(self, max_memory_mb: float) -> int:
+        """
+        Estimate how many points can be computed at once within the memory budget. The estimate covers the
+        legendre functions, spherical harmonic terms, time modified coefficients and temporaries of one chunk for the
+        kernel of the instance.
+        :param max_memory_mb: the memory budget in megabytes
+        :return: the number of points of one chunk
+        """
+
+        if max_memory_mb <= 0:
+            raise ValueError("Please provide max_memory_mb > 0.")
+
+        num_leg = (self.nmax + 1) * (self.nmax + 2) // 2
+        if self.kernel == "recursive":
+            # the recursion only keeps a few legendre functions and the sums besides the temporaries
+            num_terms = 16 + 32
+        else:
+            # Leg and dLeg are copied into 2d arrays during the summation
+            num_terms = 4 * num_leg + 3 * (self.nmax + 1) + 32
+
+        bytes_per_point = 8 * num_terms
+
+        return max(1, int(max_memory_mb * 1024 * 1024 // bytes_per_point))
+
+    def forward_chunk(self, start: int, stop: int, sv: bool = True) -> Tuple:
+        """
+        Compute the magnetic elements Bx, By, Bz, dBx, dBy and dBz for the points from start to stop. The spherical
+        harmonic terms and legendre functions are only built for these points and are not kept in the instance.
+        :param start: the index of first point
+        :param stop: the index after the last point
+        :param sv: default is True. If False, the secular variation is skipped and dBx, dBy and dBz are None.
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        index = slice(start, stop)
+
+        if np.size(self.dyear) > 1:
+            epoch_vec = self.synthesize_rows(self.coef_dict, index)
+            Bx, By, Bz, dBx, dBy, dBz = self.combine_dates(epoch_vec, self.dyear[index])
+        else:
+            Bx, By, Bz, dBx, dBy, dBz = self.synthesize_rows(self.timly_coef_dict, index, sv)
+        if not sv:
+            dBx, dBy, dBz = None, None, None
+
+        self.check_blackout_zone(Bx, By, Bz, index)
+
+        return Bx, By, Bz, dBx, dBy, dBz
+
+    def synthesize_rows(self, coef_dict: dict, index: slice, sv: bool = True) -> Tuple:
+        """
+        Sum up the field of the points in index with synthesize_points(). The spherical harmonic terms and legendre
+        functions are only built for these points and are not kept.
+        :param coef_dict: the time modified coefficients, or the coefficients at epoch for many dates
+        :param index: the slice of the points
+        :param sv: default is True. See synthesize_points()
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        return self.synthesize_points(coef_dict, self.lat[index], self.lon[index], self.r[index], self.theta[index],
+                                      sv=sv)
+
+    def forward_chunks(self, coef_dict: dict) -> Tuple:
+        """
+        Compute the magnetic vectors of all of the points in chunks of LOW_MEMORY_CHUNK_SIZE points and write them
+        into preallocated outputs. The spherical harmonic terms and legendre functions of a chunk are dropped before
+        the next chunk, so only the outputs grow with the number of points. The results are the same as computing
+        all of the points at once.
+        :param coef_dict: the time modified coefficients, or the coefficients at epoch for many dates
+        :return: magnetic elements Bx, By, Bz, dBx, dBy and dBz in geodetic degree
+        """
+
+        num_points = self.lat.size
+        vec = tuple(np.empty(num_points, dtype=np.float64) for _ in range(6))
+
+        for start in range(0, num_points, LOW_MEMORY_CHUNK_SIZE):
+            index = slice(start, min(start + LOW_MEMORY_CHUNK_SIZE, num_points))
+            for out, val in zip(vec, self.synthesize_rows(coef_dict, index)):
+                out[index] = val
+
+        return vec
+
+    def release_memory(self):
+        """
+        Drop everything the instance keeps besides the coordinates and time: the spherical harmonic terms, legendre
+        functions and the cached magnetic vectors and elements. They are computed again when they are requested.
+        """
+
+        self.reset_sh_terms()
+        self.dedup_stats = {}
+
+    def get_all(self, chunk_size: Optional[int] = None, max_memory_mb: Optional[float] = None,
+                workers: Optional[int] = None) -> dict:
         """
         Get the all of magnetic elements:
         Bx, By, Bz, Bh, Bf, Bdec, Binc
         dBx, dBy, dBz, dBh, dBf, dBdec, dBinc
 
+        If chunk_size or max_memory_mb is provided, the points are computed in chunks and written into preallocated
+        outputs, so the peak memory doesn't grow with the number of points. If workers is provided or the executor
+        is assigned to the instance, the chunks are computed by the threads.
+
+        :param chunk_size: default is None. The number of points computed at once.
+        :param max_memory_mb: default is None. The memory budget in megabytes used to choose the chunk size.
+        :param workers: default is None. The number of threads to compute the chunks.
         :return: dict object includes all of magnetic elements
         """
 
-        Bx, By, Bz = self.forward_base()
-        dBx, dBy, dBz = self.forward_sv()
+        if chunk_size is None and max_memory_mb is None and workers is None and self.executor is None:
+            mag_vec = self.get_mag_elements(sv=True)
 
-        mag_vec = wmm_elements(Bx, By, Bz, dBx, dBy, dBz)
+            return writable_results(mag_vec.get_all())
 
-        return mag_vec.get_all()
+        return self.get_elements(ALL_ELEMENTS, chunk_size=chunk_size, max_memory_mb=max_memory_mb, workers=workers)
 
-    def get_uncertainty(self):
+    def get_elements(self, elements: Union[list, tuple], chunk_size: Optional[int] = None,
+                     max_memory_mb: Optional[float] = None, workers: Optional[int] = None) -> dict:
+        """
+        Get only the requested magnetic elements. The secular variation is only computed if one of
+        dx, dy, dz, dh, df, ddec or dinc is requested.
+
+        The chunks are computed by a ThreadPoolExecutor with the number of workers, or by the executor assigned to
+        wmm_calc.executor. The legendre functions, summation and rotation are NumPy operations releasing the GIL,
+        so the threads run in parallel. The results are the same as computing the chunks one by one.
+
+        :param elements: the list of element names, e.g. ["dec", "h"]. The names are the keys of get_all().
+        :param chunk_size: default is None. The number of points computed at once.
+        :param max_memory_mb: default is None. The memory budget in megabytes used to choose the chunk size.
+        :param workers: default is None. The number of threads to compute the chunks.
+        :return: dict object includes the requested magnetic elements
+        """
+
+        elements = check_elements(elements)
+
+        sv = any(key in SV_ELEMENTS for key in elements)
+
+        if chunk_size is None and max_memory_mb is None and workers is None and self.executor is None:
+            return writable_results(self.get_mag_elements(sv=sv).get_elements(elements))
+
+        if self.lat is None or self.lon is None or self.alt is None:
+            raise TypeError("Coordinates haven't set up yet. Please use setup_env() to set up coordinates first.")
+        if self.dyear is None:
+            self.setup_time()
+        if workers is not None and (not isinstance(workers, (int, np.integer)) or workers <= 0):
+            raise ValueError("Please provide workers with a positive integer.")
+
+        num_points = self.lat.size
+
+        if chunk_size is None and max_memory_mb is None:
+            num_workers = workers if workers is not None else getattr(self.executor, "_max_workers", 1)
+            chunk_size = max(1, -(-num_points // num_workers))
+        elif chunk_size is None:
+            chunk_size = self.get_chunk_size(max_memory_mb)
+        elif not isinstance(chunk_size, (int, np.integer)) or chunk_size <= 0:
+            raise ValueError("Please provide chunk_size with a positive integer.")
+
+        mag_map = {key: np.empty(num_points, dtype=np.float64) for key in ALL_ELEMENTS if key in elements}
+
+        def compute_chunk(start: int):
+            stop = min(start + chunk_size, num_points)
+
+            mag_vec = wmm_elements(*self.forward_chunk(start, stop, sv=sv))
+            for key, val in mag_vec.get_elements(elements).items():
+                mag_map[key][start:stop] = val
+
+        starts = range(0, num_points, chunk_size)
+
+        if workers is not None:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(compute_chunk, starts))
+        elif self.executor is not None:
+            list(self.executor.map(compute_chunk, starts))
+        else:
+            for start in starts:
+                compute_chunk(start)
+
+        return mag_map
+
+    def grid(self, lats: Union[int, float, list, np.ndarray], lons: Union[int, float, list, np.ndarray],
+             alts: Union[int, float, list, np.ndarray], dyear: Union[int, float, None] = None, unit: str = "km",
+             elements: Optional[Union[list, tuple]] = None) -> dict:
+        """
+        Compute the magnetic elements on the grid of lats x lons x alts. The legendre functions and radius terms
+        are computed once for each latitude and altitude, and cos_m(lon) and sin_m(lon) once for each longitude,
+        instead of for every grid point. The time is assigned by dyear or setup_time().
+
+        :param lats: latitudes in degree of the grid rows
+        :param lons: longitudes in degree of the grid columns
+        :param alts: ellipsoid heights in km, meter or feet. If it's a scalar, the last axis of the outputs is dropped.
+        :param dyear: default is None. The decimal year. It uses the time of setup_time() if it's None.
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :param elements: default is None for all of the elements. The list of element names like get_elements().
+        :return: dict object includes the magnetic elements in (nlat, nlon, nalt) or (nlat, nlon) arrays
+        """
+
+        elements = check_elements(elements)
+
+        scalar_alt = np.ndim(alts) == 0
+        lats = convert_to_ndarray(lats).astype(np.float64).ravel()
+        lons = convert_to_ndarray(lons).astype(np.float64).ravel()
+        alts = self.to_km(convert_to_ndarray(alts).astype(np.float64).ravel(), unit)
+
+        self.check_coords(lats, lons, alts)
+
+        if dyear is not None:
+            self.setup_time(dyear=dyear)
+        elif self.dyear is None:
+            self.setup_time()
+        if np.size(self.dyear) > 1:
+            raise ValueError("The grid can only be computed for one date. Please provide a scalar dyear.")
+
+        # the rows are every pair of latitude and altitude
+        row_lat, row_alt = np.meshgrid(lats, alts, indexing="ij")
+        row_lat, row_alt = row_lat.ravel(), row_alt.ravel()
+
+        r, theta = util.geod_to_geoc_lat(row_lat, row_alt)
+        r, theta = np.array(r), np.array(theta)
+        rel_radius = sh_vars.comp_sh_vars(0.0, r, theta, self.nmax)["relative_radius_power"]
+        Leg = legendre.Flattened_Chaos_Legendre1(self.nmax, 90.0 - theta)
+
+        # only the longitude terms are used from the columns
+        sph_cols = sh_vars.comp_sh_vars(lons, 1.0, 0.0, self.nmax)
+
+        coef_dict = self.timly_coef_dict
+        Bt, Bp, Br, dBt, dBp, dBr = summation.grid_SPH_summation_sv(self.nmax, rel_radius, sph_cols["cos_mlon"],
+                                                                    sph_cols["sin_mlon"], Leg, theta, coef_dict["g"],
+                                                                    coef_dict["h"], coef_dict["g_sv"],
+                                                                    coef_dict["h_sv"])
+
+        mag_vec = summation.rotate_magvec_sv(Bt, Bp, Br, dBt, dBp, dBr, theta[:, None], row_lat[:, None])
+
+        # (nlat * nalt, nlon) to (nlat, nlon, nalt)
+        shape = (len(lats), len(alts), len(lons))
+        mag_vec = [np.ascontiguousarray(np.moveaxis(vec.reshape(shape), 1, 2)) for vec in mag_vec]
+        if scalar_alt:
+            mag_vec = [vec[:, :, 0] for vec in mag_vec]
+
+        coords = np.broadcast_arrays(*np.meshgrid(lats, lons, alts, indexing="ij", sparse=True))
+        if scalar_alt:
+            coords = [coord[:, :, 0] for coord in coords]
+        self.check_blackout_zone(mag_vec[0], mag_vec[1], mag_vec[2], coords=coords)
+
+        return wmm_elements(*mag_vec).get_elements(elements)
+
+    def time_sweep(self, dyears: Union[int, float, list, np.ndarray], elements: Optional[Union[list, tuple]] = None) -> dict:
+        """
+        Compute the magnetic elements of the coordinates from setup_env() at many dates. The field is only summed up
+        once at the epoch of the model, and the vectors of every date are B(epoch) + (dyear - epoch) * dB. The
+        elements like dec, inc, h and f are derived from the vectors of each date afterwards.
+
+        :param dyears: the decimal years
+        :param elements: default is None for all of the elements. The list of element names like get_elements().
+        :return: dict object includes the magnetic elements in (number of points, number of dates) arrays
+        """
+
+        elements = check_elements(elements)
+
+        dyears = convert_to_ndarray(dyears).astype(np.float64).ravel()
+        self.check_time(dyears)
 
-        Bx, By, Bz = self.forward_base()
+        Bx, By, Bz, dBx, dBy, dBz = self.cached_epoch()
 
-        mag_vec = wmm_elements(Bx, By, Bz)
+        date_diff = (dyears - self.coef_dict["epoch"])[None, :]
+        Bx = Bx[:, None] + date_diff * dBx[:, None]
+        By = By[:, None] + date_diff * dBy[:, None]
+        Bz = Bz[:, None] + date_diff * dBz[:, None]
+
+        shape = Bx.shape
+        dBx, dBy, dBz = (np.broadcast_to(vec[:, None], shape) for vec in (dBx, dBy, dBz))
+
+        coords = [np.broadcast_to(coord.reshape(-1, 1), shape) for coord in (self.lat, self.lon, self.alt)]
+        self.check_blackout_zone(Bx, By, Bz, coords=coords)
+
+        mag_map = wmm_elements(Bx, By, Bz, dBx, dBy, dBz).get_elements(elements)
+        for key in ("dx", "dy", "dz"):
+            if key in mag_map:
+                mag_map[key] = np.array(mag_map[key])
+
+        return mag_map
+
+    def get_uncertainty(self):
+
+        mag_vec = self.get_mag_elements()
 
         return mag_vec.get_uncertainity(self.err_vals)
 
 
+
+
+def evaluate(lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+             alt: Union[int, float, list, np.ndarray], dyear: Union[int, float, list, np.ndarray],
+             elements: Optional[Union[list, tuple]] = None, nmax: int = 12, unit: str = "km",
+             msl: bool = False, warn: bool = True) -> dict:
+    """
+    Compute the magnetic elements without a wmm_calc object. The function keeps no state between the calls and only
+    reads the shared read-only coefficients from the cache of load_wmm_coefs_cached(), so it is safe to call it
+    concurrently from many threads.
+
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude in km, meter or feet
+    :param dyear: decimal year
+    :param elements: default is all of the elements. The names of the magnetic elements, the keys of get_all().
+    :param nmax: max degree
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param warn: default is True. Set it to False to skip the warnings of the altitude and blackout zone without
+    warnings.catch_warnings(), which changes the warning filters of the whole process and isn't thread-safe.
+    :return: dict object includes the requested magnetic elements
+    """
+
+    check_nmax(nmax)
+    elements = check_elements(elements)
+    lat, lon, alt, dyear = broadcast_points(lat, lon, alt, dyear)
+
+    alt = to_km(alt, unit)
+    if msl:
+        alt = util.alt_to_ellipsoid_height(alt, lat, lon)
+
+    coef_file = os.path.join(os.path.dirname(__file__), "coefs", "WMM.COF")
+    coef_dict = load.load_wmm_coefs_cached(coef_file, nmax)
+
+    check_coords(lat, lon, alt, warn)
+    check_time_range(dyear, coef_dict)
+
+    r, theta = util.geod_to_geoc_lat(lat, alt)
+    theta = np.asarray(theta)
+    sph_dict = sh_vars.comp_sh_vars(lon, r, theta, nmax)
+    Leg = legendre.Flattened_Chaos_Legendre1(nmax, 90.0 - theta)
+
+    single_date = np.all(dyear == dyear[0])
+    if single_date:
+        coef_dict = load.timely_modify_magnetic_model(coef_dict, dyear[0], MAX_SV_DEGREE)
+
+    Bt, Bp, Br, dBt, dBp, dBr = summation.mag_SPH_summation_sv(nmax, sph_dict, coef_dict["g"], coef_dict["h"],
+                                                               coef_dict["g_sv"], coef_dict["h_sv"], Leg, theta)
+    Bx, By, Bz, dBx, dBy, dBz = summation.rotate_magvec_sv(Bt, Bp, Br, dBt, dBp, dBr, theta, lat)
+
+    if not single_date:
+        date_diff = dyear - coef_dict["epoch"]
+        Bx, By, Bz = Bx + date_diff * dBx, By + date_diff * dBy, Bz + date_diff * dBz
+
+    if warn:
+        check_blackout_zone(Bx, By, Bz, lat, lon, alt)
+
+    return wmm_elements(Bx, By, Bz, dBx, dBy, dBz).get_elements(elements)
@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import numpy as np
+
+from wmm.build import evaluate, check_elements, broadcast_points, to_km, ALL_ELEMENTS
+
+# The default max number of cached points
+DEFAULT_MAX_SIZE = 100000
+# The default quantization steps of latitude and longitude in degree, altitude in km and time in decimal year
+DEFAULT_LAT_STEP = 1e-4
+DEFAULT_LON_STEP = 1e-4
+DEFAULT_ALT_STEP = 0.001
+DEFAULT_DYEAR_STEP = 1.0 / 365.25
+
+
+class wmm_cache:
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, lat_step: float = DEFAULT_LAT_STEP,
+                 lon_step: float = DEFAULT_LON_STEP, alt_step: float = DEFAULT_ALT_STEP,
+                 dyear_step: float = DEFAULT_DYEAR_STEP, nmax: int = 12, unit: str = "km", msl: bool = False):
+        """
+        The LRU cache of the magnetic elements for repeated point queries. The points are snapped to the lattice of
+        the quantization steps, and every point on the same lattice node shares one cached result computed at the
+        first point queried on the node. The least recently used results are evicted once the cache holds max_size
+        points.
+
+        The cache is thread-safe. Only the uncached points are computed with wmm.evaluate(), outside of the lock.
+
+        :param max_size: default is 100000. The max number of cached points.
+        :param lat_step: default is 1e-4. The quantization step of latitude in degree.
+        :param lon_step: default is 1e-4. The quantization step of longitude in degree.
+        :param alt_step: default is 0.001 (1 meter). The quantization step of altitude in km.
+        :param dyear_step: default is one day. The quantization step of time in decimal year.
+        :param nmax: max degree
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+        """
+
+        if not isinstance(max_size, int) or max_size <= 0:
+            raise ValueError("Please provide max_size with a positive integer.")
+        steps = np.array([lat_step, lon_step, alt_step, dyear_step], dtype=np.float64)
+        if np.any(~(steps > 0)):
+            raise ValueError("Please provide the quantization steps with positive numbers.")
+
+        self.max_size = max_size
+        self.steps = steps
+        self.nmax = nmax
+        self.unit = unit
+        self.msl = msl
+
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def quantize(self, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, dyear: np.ndarray) -> np.ndarray:
+        """
+        Snap the points to the lattice of the quantization steps.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: altitude in km
+        :param dyear: decimal year
+        :return: the lattice indices in (number of points, 4) int64 array
+        """
+
+        points = np.stack([lat, lon, alt, dyear], axis=1)
+
+        return np.rint(points / self.steps).astype(np.int64)
+
+    def evaluate(self, lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+                 alt: Union[int, float, list, np.ndarray], dyear: Union[int, float, list, np.ndarray],
+                 elements: Optional[Union[list, tuple]] = None) -> dict:
+        """
+        Compute the magnetic elements like wmm.evaluate(). The quantized points are only the keys of the cache, the
+        cached points are read from the cache, and only the other points are computed in one vectorized call at
+        their own coordinates, so the points accepted by wmm.evaluate() are accepted here as well.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: altitude in the unit of the cache
+        :param dyear: decimal year
+        :param elements: default is all of the elements. The names of the magnetic elements, the keys of get_all().
+        :return: dict object includes the requested magnetic elements
+        """
+
+        elements = check_elements(elements)
+        lat, lon, alt, dyear = broadcast_points(lat, lon, alt, dyear)
+
+        nodes = self.quantize(lat, lon, to_km(alt, self.unit), dyear)
+        keys = list(map(tuple, nodes.tolist()))
+
+        vals = np.empty((len(keys), len(ALL_ELEMENTS)))
+        miss_rows = []
+        with self.lock:
+            for row, key in enumerate(keys):
+                result = self.results.get(key)
+                if result is None:
+                    miss_rows.append(row)
+                else:
+                    self.results.move_to_end(key)
+                    vals[row] = result
+            self.counts["hits"] += len(keys) - len(miss_rows)
+            self.counts["misses"] += len(miss_rows)
+
+        if miss_rows:
+            # the repeated points in the batch are computed once, at the first point of every node. The nodes
+            # themselves may fall outside of the valid dates or latitudes.
+            miss_nodes, first, inverse = np.unique(nodes[miss_rows], axis=0, return_index=True, return_inverse=True)
+            rows = np.asarray(miss_rows)[first]
+
+            mag_map = evaluate(lat[rows], lon[rows], alt[rows], dyear[rows], nmax=self.nmax, unit=self.unit,
+                               msl=self.msl)
+            miss_vals = np.stack([mag_map[key] for key in ALL_ELEMENTS], axis=1)
+            vals[miss_rows] = miss_vals[inverse.ravel()]
+
+            self.insert(miss_nodes, miss_vals)
+
+        return {key: vals[:, i] for i, key in enumerate(ALL_ELEMENTS) if key in elements}
+
+    def insert(self, nodes: np.ndarray, vals: np.ndarray):
+        """
+        Add the results to the cache and evict the least recently used results over max_size.
+
+        :param nodes: the lattice indices in (number of points, 4)
+        :param vals: the magnetic elements in (number of points, len(ALL_ELEMENTS))
+        """
+
+        with self.lock:
+            for key, result in zip(map(tuple, nodes.tolist()), vals):
+                # a copy of the row, so the cache doesn't keep the whole batch alive
+                self.results[key] = result.copy()
+                self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def stats(self) -> dict:
+        """
+        :return: dict object includes the hits, misses and evictions counts and the current size of the cache
+        """
+
+        with self.lock:
+            stats = dict(self.counts)
+            stats["size"] = len(self.results)
+            stats["max_size"] = self.max_size
+
+        return stats
+
+    def clear(self):
+        """
+        Remove all of the cached results and reset the statistics.
+        """
+
+        with self.lock:
+            self.results.clear()
+            self.counts = {"hits": 0, "misses": 0, "evictions": 0}
@@ -0,0 +1,27 @@
+import os
+import argparse
+
+from wmm import load
+
+
+def main(argv=None):
+    """
+    Regenerate the binary coefficient file from the text coefficient file. Run it whenever the .COF file changes:
+
+        python -m wmm.compile_coefs [path/to/WMM.COF]
+    """
+
+    default_file = os.path.join(os.path.dirname(__file__), "coefs", "WMM.COF")
+
+    parser = argparse.ArgumentParser(description="Generate the binary coefficient file from the WMM .COF file")
+    parser.add_argument("cof_file", nargs="?", default=default_file, help="the path of .COF file")
+    parser.add_argument("-o", "--output", default=None, help="the path of binary file. Default is <cof_file>.bin")
+    parser.add_argument("--nmax", type=int, default=12, help="the maximum degree of the .COF file")
+    args = parser.parse_args(argv)
+
+    bin_file = load.write_wmm_coefs_binary(args.cof_file, args.output, args.nmax)
+    print(f"Wrote {bin_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
-import copy
+import os
+import json
+import struct
+import hashlib
+import threading
 import datetime as dt
+from collections import OrderedDict
 from typing import Optional
 import numpy as np
 from geomaglib import sh_loader, util
 
+# The maximum number of parsed coefficient sets kept by load_wmm_coefs_cached()
+COEF_CACHE_SIZE = 16
+
+_coef_cache = OrderedDict()
+_coef_cache_lock = threading.Lock()
+
+# The binary coefficient file starts with the magic bytes and the length of json header,
+# followed by the json header and the little-endian float64 array of g, h, g_sv and h_sv.
+BINARY_MAGIC = b"WMMCOEF1"
+BINARY_EXT = ".bin"
+
 def load_wmm_coefs(filename: str, nmax: int):
 
     num_lines_load = sh_loader.calc_sh_degrees_to_num_elems(nmax)
 
     coef_dict = {}
-    coef_dict["g"] = [0]*(num_lines_load+1)
-    coef_dict["h"] = [0] * (num_lines_load + 1)
-    coef_dict["g_sv"] = [0] * (num_lines_load + 1)
-    coef_dict["h_sv"] = [0] * (num_lines_load + 1)
+    coef_dict["g"] = np.zeros(num_lines_load + 1)
+    coef_dict["h"] = np.zeros(num_lines_load + 1)
+    coef_dict["g_sv"] = np.zeros(num_lines_load + 1)
+    coef_dict["h_sv"] = np.zeros(num_lines_load + 1)
 
 
 
@@ -49,6 +65,161 @@ def load_wmm_coefs(filename: str, nmax: int):
     return coef_dict
 
 
+def get_binary_path(filename: str) -> str:
+    """
+    Get the path of the binary coefficient file generated from the text coefficient file
+    """
+
+    return os.path.splitext(filename)[0] + BINARY_EXT
+
+
+def calc_file_sha256(filename: str) -> str:
+
+    with open(filename, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def write_wmm_coefs_binary(filename: str, bin_file: Optional[str] = None, nmax: int = 12) -> str:
+    """
+    Parse the text coefficient file and save it as the binary coefficient file. The header keeps the epoch, model
+    name, minimal date and the sha256 of the text file, so the binary file can be checked against its source.
+
+    Parameters:
+    filename (str): the path of text coefficient file
+    bin_file (str): the path of binary coefficient file. Default is the text file path with the extension .bin
+    nmax (int): the maximum degree of the coefficient file
+
+    Returns:
+    str: the path of binary coefficient file
+    """
+
+    if bin_file is None:
+        bin_file = get_binary_path(filename)
+
+    coef_dict = load_wmm_coefs(filename, nmax)
+
+    header = {
+        "epoch": coef_dict["epoch"],
+        "model_name": coef_dict["model_name"],
+        "min_year": float(coef_dict["min_year"][0]),
+        "min_date": coef_dict["min_date"],
+        "nmax": nmax,
+        "num_coefs": len(coef_dict["g"]),
+        "source_sha256": calc_file_sha256(filename),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    # pad the header, so the coefficients are aligned to 8 bytes
+    header_bytes += b" " * (-(len(BINARY_MAGIC) + 4 + len(header_bytes)) % 8)
+
+    coefs = np.stack([coef_dict["g"], coef_dict["h"], coef_dict["g_sv"], coef_dict["h_sv"]]).astype("<f8")
+
+    with open(bin_file, "wb") as fp:
+        fp.write(BINARY_MAGIC)
+        fp.write(struct.pack("<I", len(header_bytes)))
+        fp.write(header_bytes)
+        fp.write(coefs.tobytes())
+
+    return bin_file
+
+
+def load_wmm_coefs_binary(filename: str, nmax: int) -> Optional[dict]:
+    """
+    Load the coefficients from the binary coefficient file next to the text coefficient file. The arrays are read-only
+    views of the file buffer.
+
+    Parameters:
+    filename (str): the path of text coefficient file
+    nmax (int): the maximum degree to be loaded
+
+    Returns:
+    dictionary: the coefficients and meta data like load_wmm_coefs(), or None if the binary file doesn't exist,
+    is broken or was generated from a different text file
+    """
+
+    bin_file = get_binary_path(filename)
+    if not os.path.isfile(bin_file):
+        return None
+
+    with open(bin_file, "rb") as fp:
+        buffer = fp.read()
+
+    offset = len(BINARY_MAGIC) + 4
+    if len(buffer) < offset or buffer[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        return None
+
+    header_len = struct.unpack("<I", buffer[len(BINARY_MAGIC):offset])[0]
+    header = json.loads(buffer[offset:offset + header_len].decode("utf-8"))
+
+    num_elems = sh_loader.calc_sh_degrees_to_num_elems(nmax)
+    if nmax > header["nmax"] or header["source_sha256"] != calc_file_sha256(filename):
+        return None
+
+    coefs = np.frombuffer(buffer, dtype="<f8", offset=offset + header_len).reshape(4, header["num_coefs"])
+
+    coef_dict = {}
+    for i, key in enumerate(["g", "h", "g_sv", "h_sv"]):
+        if nmax == header["nmax"]:
+            coef_dict[key] = coefs[i]
+        else:
+            # the text parser doesn't load the last coefficient of nmax
+            coef_dict[key] = np.zeros(num_elems + 1)
+            coef_dict[key][:num_elems] = coefs[i, :num_elems]
+
+    coef_dict["epoch"] = header["epoch"]
+    coef_dict["model_name"] = header["model_name"]
+    coef_dict["min_year"] = np.array([header["min_year"]])
+    coef_dict["min_date"] = header["min_date"]
+
+    return coef_dict
+
+
+def load_wmm_coefs_cached(filename: str, nmax: int) -> dict:
+    """
+    Load the WMM coefficients through a process-wide cache keyed by the file path, modified time and nmax, so the
+    coefficient file is parsed only once for all wmm_calc instances. The coefficient arrays are shared and read-only.
+    The binary coefficient file is preferred if it exists and matches the text coefficient file.
+    The least recently used coefficient set is dropped when more than COEF_CACHE_SIZE sets are cached.
+
+    Parameters:
+    filename (str): the path of coefficient file
+    nmax (int): the maximum degree to be loaded
+
+    Returns:
+    dictionary: the coefficients and meta data like load_wmm_coefs()
+    """
+
+    key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns, nmax)
+
+    with _coef_cache_lock:
+        if key in _coef_cache:
+            _coef_cache.move_to_end(key)
+            return dict(_coef_cache[key])
+
+    coef_dict = load_wmm_coefs_binary(filename, nmax)
+    if coef_dict is None:
+        coef_dict = load_wmm_coefs(filename, nmax)
+    for val in coef_dict.values():
+        if isinstance(val, np.ndarray):
+            val.setflags(write=False)
+
+    with _coef_cache_lock:
+        _coef_cache[key] = coef_dict
+        _coef_cache.move_to_end(key)
+        while len(_coef_cache) > COEF_CACHE_SIZE:
+            _coef_cache.popitem(last=False)
+
+    return dict(coef_dict)
+
+
+def clear_cache():
+    """
+    Drop all of the coefficient sets cached by load_wmm_coefs_cached()
+    """
+
+    with _coef_cache_lock:
+        _coef_cache.clear()
+
+
 def timely_modify_magnetic_model(sh_dict, dec_year, max_sv: Optional[int] = None):
     """
     Time change the Model coefficients from the base year of the model(epoch) using secular variation coefficients.
@@ -59,29 +230,50 @@ Copy the SV coefficients.  If input "t�" is the same as "t0", then this is mer
     sh_dict (dictionary): This is the input dictionary, you would get this dictionary from using the load_coef function
     dec_year(float or int): Decimal year input for calculating the time shift
     epoch (float or int): The base year of the model
+    max_sv(int): The maximum degree of the coefficients to be shifted
 
-`   Returns:
-    dictionary: Copy of sh_dict with the elements timely shifted
+    Returns:
+    dictionary: Copy of sh_dict with the elements timely shifted. If dec_year is a vector, g and h are
+    (number of coefficients, number of dates) arrays.
     """
 
-    sh_dict_time = copy.deepcopy(sh_dict)
+    sh_dict_time = dict(sh_dict)
     epoch = sh_dict.get("epoch", 0)
     # If the sh_dict doesn't have secular variations just return a copy
     # of the dictionary
-    num_elems = len(sh_dict["g"])
+    if "g_sv" not in sh_dict or "h_sv" not in sh_dict:
+        return sh_dict_time
+
+    g = np.asarray(sh_dict["g"], dtype=np.float64)
+    h = np.asarray(sh_dict["h"], dtype=np.float64)
+    g_sv = np.asarray(sh_dict["g_sv"], dtype=np.float64)
+    h_sv = np.asarray(sh_dict["h_sv"], dtype=np.float64)
+    num_elems = len(g)
 
     if max_sv is None:
         max_sv = sh_loader.calc_num_elems_to_sh_degrees(num_elems)
-    if "g_sv" not in sh_dict or "h_sv" not in sh_dict:
-        return sh_dict_time
+    # Only the coefficients up to degree max_sv are shifted, the index 0 is not used
+    num_sv = min(num_elems, sh_loader.calc_sh_degrees_to_num_elems(max_sv))
+
+    date_diff = np.asarray(dec_year - epoch, dtype=np.float64)
 
-    date_diff = dec_year - epoch
-    for n in range(1, (max_sv + 1)):
-        for m in range(n + 1):
-            index = int(n * (n + 1) / 2 + m)
-            if index < num_elems:
-                sh_dict_time["g"][index] = sh_dict["g"][index] + date_diff * sh_dict["g_sv"][index]
-                sh_dict_time["h"][index] = sh_dict["h"][index] + date_diff * sh_dict["h_sv"][index]
+    if date_diff.size == 1:
+        date_diff = date_diff.item()
+        g_time = g.copy()
+        h_time = h.copy()
+        g_time[1:num_sv] = g[1:num_sv] + date_diff * g_sv[1:num_sv]
+        h_time[1:num_sv] = h[1:num_sv] + date_diff * h_sv[1:num_sv]
+    else:
+        # the coefficients of each date are saved in the columns, so g_time[index] is the array over the dates
+        date_diff = date_diff.reshape(1, -1)
+        g_time = np.repeat(g[:, None], date_diff.shape[1], axis=1)
+        h_time = np.repeat(h[:, None], date_diff.shape[1], axis=1)
+        g_time[1:num_sv] = g[1:num_sv, None] + date_diff * g_sv[1:num_sv, None]
+        h_time[1:num_sv] = h[1:num_sv, None] + date_diff * h_sv[1:num_sv, None]
 
+    sh_dict_time["g"] = g_time
+    sh_dict_time["h"] = h_time
+    sh_dict_time["g_sv"] = g_sv
+    sh_dict_time["h_sv"] = h_sv
 
-    return sh_dict_time
\ No newline at end of file
+    return sh_dict_time
@@ -0,0 +1,165 @@
+import os
+import warnings
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Optional, Union
+
+import numpy as np
+
+from geomaglib import util
+
+from wmm.build import wmm_calc, check_elements, broadcast_points
+
+# The number of points computed by a worker at once when chunk_size is not provided
+DEFAULT_CHUNK_SIZE = 100000
+
+# The coefficient arrays shared with the workers, in the row order of the shared block
+COEF_KEYS = ("g", "h", "g_sv", "h_sv")
+
+# The state of the worker process. It is built once by init_worker() and reused by every chunk.
+_worker = {}
+
+
+def init_worker(input_name: str, coef_name: str, output_name: str, num_points: int, num_coefs: int,
+                coef_meta: dict, elements: tuple, nmax: int):
+    """
+    Attach the shared input, coefficient and output blocks and build the wmm_calc of the worker process.
+
+    :param input_name: the name of the shared block of lat, lon, alt and dyear in (4, num_points)
+    :param coef_name: the name of the shared block of g, h, g_sv and h_sv in (4, num_coefs)
+    :param output_name: the name of the shared block of the elements in (number of elements, num_points)
+    :param num_points: the number of points
+    :param num_coefs: the length of the coefficient arrays
+    :param coef_meta: the epoch, model name, min_year and min_date of the coefficients
+    :param elements: the names of the magnetic elements
+    :param nmax: max degree
+    """
+
+    # the workers share the resource tracker of the parent process, which unlinks the blocks
+    blocks = [shared_memory.SharedMemory(name=name) for name in (input_name, coef_name, output_name)]
+    inputs = np.ndarray((4, num_points), dtype=np.float64, buffer=blocks[0].buf)
+    coefs = np.ndarray((4, num_coefs), dtype=np.float64, buffer=blocks[1].buf)
+    outputs = np.ndarray((len(elements), num_points), dtype=np.float64, buffer=blocks[2].buf)
+
+    coefs.flags.writeable = False
+
+    model = wmm_calc(nmax)
+    model.coef_dict = dict(coef_meta)
+    for i, key in enumerate(COEF_KEYS):
+        model.coef_dict[key] = coefs[i]
+
+    _worker.clear()
+    _worker.update(blocks=blocks, inputs=inputs, outputs=outputs, elements=elements, model=model)
+
+
+def evaluate_chunk(start: int, stop: int) -> list:
+    """
+    Compute the magnetic elements of the points from start to stop with the warm wmm_calc of the worker, and write
+    them into the shared output block.
+
+    :param start: the first index of the chunk
+    :param stop: the index after the last point of the chunk
+    :return: the messages of the warnings raised by the chunk
+    """
+
+    model = _worker["model"]
+    inputs = _worker["inputs"]
+    outputs = _worker["outputs"]
+    elements = _worker["elements"]
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        model.setup_env(inputs[0, start:stop], inputs[1, start:stop], inputs[2, start:stop],
+                        dyear=inputs[3, start:stop])
+        mag_map = model.get_elements(elements)
+
+    for i, key in enumerate(elements):
+        outputs[i, start:stop] = mag_map[key]
+
+    return [(str(w.message), w.category) for w in caught]
+
+
+def evaluate(lat: Union[float, list, np.ndarray], lon: Union[float, list, np.ndarray],
+             alt: Union[float, list, np.ndarray], dyear: Union[float, list, np.ndarray],
+             elements: Optional[Union[list, tuple]] = None, processes: Optional[int] = None,
+             chunk_size: Optional[int] = None, unit: str = "km", msl: bool = False, nmax: int = 12) -> dict:
+    """
+    Compute the magnetic elements with a pool of processes. The input columns, the coefficients and the outputs are
+    kept in shared memory, so the workers read and write them without pickling or copying. Every worker keeps one
+    wmm_calc with the loaded coefficients and computes the chunks of points assigned to it.
+
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude in km, meter or feet
+    :param dyear: decimal year
+    :param elements: default is all of the elements. The names of the magnetic elements, the keys of get_all().
+    :param processes: default is the number of CPUs. The number of worker processes.
+    :param chunk_size: default is None. The number of points computed by a worker at once.
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param nmax: max degree
+    :return: dict object includes the requested magnetic elements
+    """
+
+    elements = check_elements(elements)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if not isinstance(processes, (int, np.integer)) or processes <= 0:
+        raise ValueError("Please provide processes with a positive integer.")
+
+    lat, lon, alt, dyear = broadcast_points(lat, lon, alt, dyear)
+
+    model = wmm_calc(nmax)
+    alt = model.to_km(alt, unit)
+    if msl:
+        alt = util.alt_to_ellipsoid_height(alt, lat, lon)
+    model.check_coords(lat, lon, alt)
+    model.check_time(dyear)
+
+    num_points = lat.size
+    if chunk_size is None:
+        chunk_size = min(DEFAULT_CHUNK_SIZE, max(1, -(-num_points // processes)))
+    elif not isinstance(chunk_size, (int, np.integer)) or chunk_size <= 0:
+        raise ValueError("Please provide chunk_size with a positive integer.")
+
+    if processes == 1:
+        model.setup_time(dyear=dyear)
+        model.setup_env(lat, lon, alt)
+        return model.get_elements(elements, chunk_size=chunk_size)
+
+    coef_meta = {key: val for key, val in model.coef_dict.items() if key not in COEF_KEYS}
+    num_coefs = len(model.coef_dict["g"])
+
+    blocks = []
+    try:
+        input_shm = shared_memory.SharedMemory(create=True, size=4 * num_points * 8)
+        blocks.append(input_shm)
+        coef_shm = shared_memory.SharedMemory(create=True, size=4 * num_coefs * 8)
+        blocks.append(coef_shm)
+        output_shm = shared_memory.SharedMemory(create=True, size=len(elements) * num_points * 8)
+        blocks.append(output_shm)
+
+        inputs = np.ndarray((4, num_points), dtype=np.float64, buffer=input_shm.buf)
+        inputs[:] = (lat, lon, alt, dyear)
+        coefs = np.ndarray((4, num_coefs), dtype=np.float64, buffer=coef_shm.buf)
+        coefs[:] = [model.coef_dict[key] for key in COEF_KEYS]
+        outputs = np.ndarray((len(elements), num_points), dtype=np.float64, buffer=output_shm.buf)
+
+        initargs = (input_shm.name, coef_shm.name, output_shm.name, num_points, num_coefs, coef_meta, elements, nmax)
+        tasks = [(start, min(start + chunk_size, num_points)) for start in range(0, num_points, chunk_size)]
+
+        with multiprocessing.get_context().Pool(processes, initializer=init_worker, initargs=initargs) as pool:
+            caught = pool.starmap(evaluate_chunk, tasks)
+
+        for message, category in dict.fromkeys(w for chunk in caught for w in chunk):
+            warnings.warn(message, category)
+
+        mag_map = {key: outputs[i].copy() for i, key in enumerate(elements)}
+        del inputs, coefs, outputs
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return mag_map
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import numpy as np
+from geomaglib import util, sh_vars, legendre
+
+from wmm.build import broadcast_points, to_km, check_coords, check_nmax
+
+# The max number of PreparedPoints kept in memory by prepare()
+PREPARED_CACHE_SIZE = 8
+
+# The PreparedPoints of the latest coordinates, keyed by points_key()
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def points_key(lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, nmax: int, unit: str, msl: bool) -> str:
+    """
+    Hash the coordinate arrays and the settings of the geometry.
+
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude
+    :param nmax: max degree
+    :param unit: the unit of altitude
+    :param msl: True if the altitude is the height above mean sea level
+    :return: the hex digest of the coordinates
+    """
+
+    digest = hashlib.sha1(f"{nmax},{unit},{msl},{lat.size}".encode("utf-8"))
+    for val in (lat, lon, alt):
+        digest.update(np.ascontiguousarray(val, dtype=np.float64).tobytes())
+
+    return digest.hexdigest()
+
+
+class PreparedPoints:
+
+    def __init__(self, lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+                 alt: Union[int, float, list, np.ndarray], nmax: int = 12, unit: str = "km", msl: bool = False):
+        """
+        The geometry of fixed coordinates which doesn't depend on the time: the geocentric radius and latitude,
+        the spherical harmonic terms and the legendre functions. Hand it to wmm_calc.setup_points() for any date
+        instead of computing the geometry again in setup_env(). The object and its arrays are read-only.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: altitude in km, meter or feet
+        :param nmax: max degree
+        :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+        :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+        """
+
+        check_nmax(nmax)
+        lat, lon, alt = broadcast_points(lat, lon, alt)
+
+        key = points_key(lat, lon, alt, nmax, unit, msl)
+
+        alt = to_km(alt, unit)
+        if msl:
+            alt = util.alt_to_ellipsoid_height(alt, lat, lon)
+        check_coords(lat, lon, alt)
+
+        r, theta = util.geod_to_geoc_lat(lat, alt)
+        r, theta = np.array(r), np.array(theta)
+        sph_dict = sh_vars.comp_sh_vars(lon, r, theta, nmax)
+        Leg = legendre.Flattened_Chaos_Legendre1(nmax, 90.0 - theta)
+
+        # the lists of terms are stacked into (nmax + 1, number of points) arrays, so they can be saved and shared
+        sph_dict = {name: np.array([np.broadcast_to(term, lat.shape) for term in terms])
+                    for name, terms in sph_dict.items()}
+
+        self.set_arrays(key, nmax, lat, lon, alt, r, theta, sph_dict, np.array(Leg))
+
+    def set_arrays(self, key: str, nmax: int, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, r: np.ndarray,
+                   theta: np.ndarray, sph_dict: dict, Leg: np.ndarray):
+        arrays = {"lat": lat, "lon": lon, "alt": alt, "r": r, "theta": theta, "Leg": Leg}
+        arrays.update({f"sph_{name}": val for name, val in sph_dict.items()})
+        for name, val in arrays.items():
+            val = np.ascontiguousarray(val, dtype=np.float64)
+            val.setflags(write=False)
+            arrays[name] = val
+
+        object.__setattr__(self, "key", key)
+        object.__setattr__(self, "nmax", nmax)
+        for name in ("lat", "lon", "alt", "r", "theta", "Leg"):
+            object.__setattr__(self, name, arrays[name])
+        object.__setattr__(self, "sph_dict", {name[4:]: val for name, val in arrays.items() if name.startswith("sph_")})
+
+    def __setattr__(self, name, val):
+        raise AttributeError("PreparedPoints is read-only. Please prepare the new coordinates instead.")
+
+    def __len__(self) -> int:
+        return self.lat.size
+
+    @classmethod
+    def load(cls, path: str) -> "PreparedPoints":
+        """
+        Read the geometry saved by PreparedPoints.save().
+
+        :param path: the path of .npz file
+        :return: PreparedPoints object
+        """
+
+        points = cls.__new__(cls)
+        with np.load(path) as data:
+            sph_dict = {name[4:]: data[name] for name in data.files if name.startswith("sph_")}
+            points.set_arrays(str(data["key"]), int(data["nmax"]), data["lat"], data["lon"], data["alt"], data["r"],
+                              data["theta"], sph_dict, data["Leg"])
+
+        return points
+
+    def save(self, path: str):
+        """
+        Save the geometry to a .npz file. The file is written to a temporary file first and then renamed, so an
+        interrupted save doesn't leave a broken file.
+
+        :param path: the path of .npz file
+        """
+
+        arrays = {f"sph_{name}": val for name, val in self.sph_dict.items()}
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                np.savez(fp, key=self.key, nmax=self.nmax, lat=self.lat, lon=self.lon, alt=self.alt, r=self.r,
+                         theta=self.theta, Leg=self.Leg, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def prepare(lat: Union[int, float, list, np.ndarray], lon: Union[int, float, list, np.ndarray],
+            alt: Union[int, float, list, np.ndarray], nmax: int = 12, unit: str = "km", msl: bool = False,
+            cache_dir: Optional[str] = None) -> PreparedPoints:
+    """
+    Get the PreparedPoints of the coordinates. The latest PREPARED_CACHE_SIZE objects are kept in memory by the hash
+    of their coordinates. If cache_dir is provided, the geometry is also read from and saved to
+    <cache_dir>/<hash>.npz, so a restarted worker skips the geometry.
+
+    :param lat: latitude in degree
+    :param lon: longitude in degree
+    :param alt: altitude in km, meter or feet
+    :param nmax: max degree
+    :param unit: default is kilometer. assign "m" for meter or "feet" if your altitude is not based on km.
+    :param msl: default is False. set it to True if the altitude is the height above mean sea level.
+    :param cache_dir: default is None. The folder of the saved geometry.
+    :return: PreparedPoints object
+    """
+
+    arrays = broadcast_points(lat, lon, alt)
+
+    key = points_key(*arrays, nmax, unit, msl)
+    with _prepared_lock:
+        if key in _prepared:
+            _prepared.move_to_end(key)
+            return _prepared[key]
+
+    path = None if cache_dir is None else os.path.join(cache_dir, f"{key}.npz")
+    if path is not None and os.path.exists(path):
+        points = PreparedPoints.load(path)
+    else:
+        points = PreparedPoints(*arrays, nmax=nmax, unit=unit, msl=msl)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            points.save(path)
+
+    with _prepared_lock:
+        _prepared[key] = points
+        _prepared.move_to_end(key)
+        while len(_prepared) > PREPARED_CACHE_SIZE:
+            _prepared.popitem(last=False)
+
+    return points
+
+
+def clear_cache():
+    """
+    Drop the PreparedPoints kept in memory by prepare().
+    """
+
+    with _prepared_lock:
+        _prepared.clear()
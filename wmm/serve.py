@@ -0,0 +1,366 @@
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import numpy as np
+
+from wmm.build import evaluate, check_nmax, check_elements, broadcast_points, ALL_ELEMENTS
+
+# The max number of points computed in one batch
+DEFAULT_MAX_BATCH = 4096
+# The max time in seconds a request waits for other requests to join its batch
+DEFAULT_MAX_WAIT = 0.002
+# The max time in seconds a request waits for the result of its batch
+DEFAULT_TIMEOUT = 30.0
+# The number of the latest requests used for the latency percentiles
+LATENCY_WINDOW = 10000
+
+
+class Batcher:
+
+    def __init__(self, max_batch: int = DEFAULT_MAX_BATCH, max_wait: float = DEFAULT_MAX_WAIT, nmax: int = 12):
+        """
+        Collect the points of concurrent requests and compute them with one vectorized wmm.evaluate(). A batch is
+        computed when it reaches max_batch points or its first request has waited max_wait seconds.
+
+        :param max_batch: the max number of points computed in one batch
+        :param max_wait: the max time in seconds a request waits for other requests to join its batch
+        :param nmax: max degree
+        """
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.nmax = nmax
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.stats = {"batches": 0, "batch_points": 0}
+        self.thread = threading.Thread(target=self.run, name="wmm-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, lat: np.ndarray, lon: np.ndarray, alt: np.ndarray, dyear: np.ndarray, elements: tuple) -> Future:
+        """
+        Add the points of one request to the queue.
+
+        :param lat: latitude in degree
+        :param lon: longitude in degree
+        :param alt: altitude in km
+        :param dyear: decimal year
+        :param elements: the names of the magnetic elements
+        :return: the future of the dict object includes the requested magnetic elements
+        """
+
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("The batcher has been closed.")
+            self.pending.append(((lat, lon, alt, dyear), elements, future, time.monotonic()))
+            self.cond.notify()
+
+        return future
+
+    def next_batch(self) -> list:
+        """
+        Wait for the next batch under the max-batch/max-wait policy.
+
+        :return: the list of requests in the batch. It is empty if the batcher is closed.
+        """
+
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return []
+
+            deadline = self.pending[0][3] + self.max_wait
+            while not self.closed and sum(item[0][0].size for item in self.pending) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.cond.wait(timeout)
+
+            batch = [self.pending.popleft()]
+            num_points = batch[0][0][0].size
+            while self.pending and num_points + self.pending[0][0][0].size <= self.max_batch:
+                num_points += self.pending[0][0][0].size
+                batch.append(self.pending.popleft())
+
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            self.compute(batch)
+
+    def compute(self, batch: list):
+        """
+        Compute the batch and set the results of the requests. If the batch fails, e.g. one of the points is out of
+        the valid range, the requests are computed one by one so only the invalid requests get the exception.
+
+        :param batch: the list of requests
+        """
+
+        columns = [np.concatenate([item[0][i] for item in batch]) for i in range(4)]
+        elements = tuple(key for key in ALL_ELEMENTS if any(key in item[1] for item in batch))
+
+        try:
+            # the warnings are skipped by evaluate() itself, the warning filters are shared by the handler threads
+            mag_map = evaluate(*columns, elements=elements, nmax=self.nmax, warn=False)
+        except Exception as err:
+            if len(batch) == 1:
+                batch[0][2].set_exception(err)
+            else:
+                for item in batch:
+                    self.compute([item])
+            return
+
+        with self.cond:
+            self.stats["batches"] += 1
+            self.stats["batch_points"] += columns[0].size
+
+        start = 0
+        for points, keys, future, _ in batch:
+            stop = start + points[0].size
+            future.set_result({key: mag_map[key][start:stop] for key in keys})
+            start = stop
+
+    def get_stats(self) -> dict:
+        """
+        :return: the copy of the batches and batch_points counters
+        """
+
+        with self.cond:
+            return dict(self.stats)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        The throughput and latency counters of the service
+        """
+
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.counts = {"requests": 0, "points": 0, "errors": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, num_points: int, latency: float, error: bool = False):
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["points"] += num_points
+            self.counts["errors"] += int(error)
+            self.latencies.append(latency)
+
+    def render(self, batcher: Batcher) -> str:
+        """
+        Format the counters in the Prometheus text format.
+
+        :param batcher: the batcher of the service
+        :return: the text of /metrics
+        """
+
+        with self.lock:
+            uptime = time.monotonic() - self.start_time
+            counts = dict(self.counts)
+            latencies = np.array(self.latencies)
+        batch_stats = batcher.get_stats()
+
+        lines = [
+            f"wmm_uptime_seconds {uptime:.3f}",
+            f"wmm_requests_total {counts['requests']}",
+            f"wmm_points_total {counts['points']}",
+            f"wmm_errors_total {counts['errors']}",
+            f"wmm_batches_total {batch_stats['batches']}",
+            f"wmm_batch_points_total {batch_stats['batch_points']}",
+            f"wmm_points_per_second {counts['points'] / uptime if uptime > 0 else 0.0:.3f}",
+        ]
+        for q in (50, 90, 99):
+            val = np.percentile(latencies, q) if latencies.size else 0.0
+            lines.append(f'wmm_request_latency_seconds{{quantile="0.{q}"}} {val:.6f}')
+
+        return "\n".join(lines) + "\n"
+
+
+def parse_query(query: dict) -> tuple:
+    """
+    Read the points of a JSON query. lat, lon, alt and dyear are numbers for a single point or lists for a batch.
+
+    :param query: the JSON object of the query
+    :return: lat, lon, alt, dyear arrays, the elements and True if the query is a single point
+    """
+
+    if not isinstance(query, dict):
+        raise ValueError("Please provide the query as a JSON object.")
+
+    missing = [key for key in ("lat", "lon", "alt", "dyear") if key not in query]
+    if missing:
+        raise ValueError(f"The query is missing {missing}.")
+
+    single = all(np.isscalar(query[key]) for key in ("lat", "lon", "alt", "dyear"))
+
+    empty = [key for key in ("lat", "lon", "alt", "dyear") if isinstance(query[key], list) and not query[key]]
+    if empty:
+        raise ValueError(f"The query has empty lists of {empty}. Please provide at least one point.")
+
+    try:
+        columns = [np.ascontiguousarray(col)
+                   for col in broadcast_points(*[query[key] for key in ("lat", "lon", "alt", "dyear")])]
+    except (TypeError, ValueError):
+        raise ValueError("lat, lon, alt and dyear should be numbers or lists of numbers with matching length.")
+
+    elements = query.get("elements", ALL_ELEMENTS)
+    if isinstance(elements, str):
+        elements = elements.split(",")
+    elements = check_elements(elements)
+
+    return (*columns, elements, single)
+
+
+class WMMRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "wmm-serve"
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, status: int, body: str, content_type: str = "application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_body(200, self.server.metrics.render(self.server.batcher), "text/plain; version=0.0.4")
+        elif self.path == "/health":
+            self.send_body(200, json.dumps({"status": "ok"}))
+        else:
+            self.send_body(404, json.dumps({"error": f"Unknown path {self.path}"}))
+
+    def do_POST(self):
+        if self.path != "/evaluate":
+            self.send_body(404, json.dumps({"error": f"Unknown path {self.path}"}))
+            return
+
+        start = time.monotonic()
+        num_points = 0
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length) or b"null")
+            lat, lon, alt, dyear, elements, single = parse_query(query)
+            num_points = lat.size
+
+            future = self.server.batcher.submit(lat, lon, alt, dyear, elements)
+            mag_map = future.result(self.server.result_timeout)
+        except FutureTimeoutError:
+            self.server.metrics.record(num_points, time.monotonic() - start, error=True)
+            message = f"The batch didn't finish in {self.server.result_timeout} seconds."
+            self.send_body(504, json.dumps({"error": message}))
+            return
+        except (ValueError, TypeError) as err:
+            self.server.metrics.record(num_points, time.monotonic() - start, error=True)
+            self.send_body(400, json.dumps({"error": str(err)}))
+            return
+        except Exception as err:
+            self.server.metrics.record(num_points, time.monotonic() - start, error=True)
+            self.send_body(500, json.dumps({"error": str(err)}))
+            return
+
+        if single:
+            body = {key: float(val[0]) for key, val in mag_map.items()}
+        else:
+            body = {key: val.tolist() for key, val in mag_map.items()}
+
+        self.server.metrics.record(num_points, time.monotonic() - start)
+        self.send_body(200, json.dumps(body))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class WMMServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, max_batch: int = DEFAULT_MAX_BATCH, max_wait: float = DEFAULT_MAX_WAIT,
+                 nmax: int = 12, verbose: bool = False, result_timeout: float = DEFAULT_TIMEOUT):
+        """
+        The HTTP service of WMM. POST the JSON queries to /evaluate and GET the counters from /metrics.
+
+        :param address: the (host, port) to listen
+        :param max_batch: the max number of points computed in one batch
+        :param max_wait: the max time in seconds a request waits for other requests to join its batch
+        :param nmax: max degree
+        :param verbose: default is False. Set it to True to log every request.
+        :param result_timeout: default is 30. The max time in seconds a request waits for the result of its batch before it
+        gets status 504.
+        """
+
+        # an invalid nmax fails at the launch instead of on every request
+        nmax = check_nmax(nmax)
+        if not result_timeout > 0:
+            raise ValueError("Please provide result_timeout > 0.")
+
+        super().__init__(address, WMMRequestHandler)
+        self.batcher = Batcher(max_batch, max_wait, nmax)
+        self.metrics = Metrics()
+        self.verbose = verbose
+        self.result_timeout = result_timeout
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+def main(argv: Optional[list] = None):
+    """
+    Run the HTTP service of WMM on localhost:
+
+        python -m wmm.serve [--host 127.0.0.1] [--port 8080] [--max-batch 4096] [--max-wait 0.002] [--timeout 30]
+    """
+
+    parser = argparse.ArgumentParser(description="Serve the WMM magnetic elements over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="the host to listen. Default is 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="the port to listen. Default is 8080")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="the max number of points computed in one batch")
+    parser.add_argument("--max-wait", type=float, default=DEFAULT_MAX_WAIT,
+                        help="the max time in seconds a request waits for other requests to join its batch")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="the max time in seconds a request waits for the result of its batch")
+    parser.add_argument("--nmax", type=int, default=12, help="the max degree of the model")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    try:
+        server = WMMServer((args.host, args.port), args.max_batch, args.max_wait, args.nmax, args.verbose,
+                           args.timeout)
+    except (TypeError, ValueError) as err:
+        parser.error(str(err))
+    print(f"Serving WMM on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
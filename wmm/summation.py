@@ -0,0 +1,329 @@
+import math
+import warnings
+from typing import Tuple, Union
+
+import numpy as np
+
+from geomaglib import magmath, sh_vars
+
+# The mean radius in km of the spherical harmonic expansion
+EARTH_RADIUS = 6371.2
+# The colatitudes this close to the poles are shifted like geomaglib.legendre.Flattened_Chaos_Legendre1()
+POLE_EPSILON = 1e-6
+
+
+def mag_SPH_summation_sv(nmax: int, sph: dict, g: np.ndarray, h: np.ndarray, g_sv: np.ndarray, h_sv: np.ndarray,
+                         Leg: list, geoc_lat: Union[list, np.ndarray], sv: bool = True) -> Tuple:
+    """
+    Compute the magnetic elements (B_theta, B_phi, B_radius) and their secular variation in one pass over degree and
+    order. The radius power and legendre terms of each (n, m) are shared by the main field and secular variation.
+    The main field is summed up in the same order with or without the secular variation, so it is the same either way.
+
+    :param nmax: max degree
+    :param sph: the dict saved with spherical harmonic variables like (a/r) ^ (n+2), cos_m(lon), and sin_m(lon)
+    :param g: g coefficients
+    :param h: h coefficients
+    :param g_sv: g secular variation coefficients
+    :param h_sv: h secular variation coefficients
+    :param Leg: legendre function array. Leg[0] for Plm array; Leg[1] for dPlm array.
+    :param geoc_lat: geocentric latitude in degree
+    :param sv: default is True. If False, the secular variation is skipped and dB_theta, dB_phi, dB_radius are None.
+    :return: B_theta, B_phi, B_radius, dB_theta, dB_phi, dB_radius
+    """
+
+    if isinstance(geoc_lat, list):
+        geoc_lat = np.array(geoc_lat)
+
+    num_points = len(geoc_lat)
+    Bt, Bp, Br = np.zeros(num_points), np.zeros(num_points), np.zeros(num_points)
+    dBt, dBp, dBr = np.zeros(num_points), np.zeros(num_points), np.zeros(num_points)
+
+    legP = Leg[0]
+    legdP = Leg[1]
+    rel_radius = sph["relative_radius_power"]
+    cos_mlon = sph["cos_mlon"]
+    sin_mlon = sph["sin_mlon"]
+
+    pidx = 1
+
+    for m in range(nmax + 1):
+        cos_m = cos_mlon[m]
+        sin_m = sin_mlon[m]
+
+        for n in range(m, nmax + 1):
+            if n == 0:
+                continue
+            gidx = n * (n + 1) // 2 + m
+
+            r_dP = rel_radius[n] * legdP[pidx]
+            r_P = rel_radius[n] * legP[pidx]
+
+            gh_cos = g[gidx] * cos_m + h[gidx] * sin_m
+            gh_sin = g[gidx] * sin_m - h[gidx] * cos_m
+
+            Bt -= gh_cos * r_dP
+            if m > 0:
+                Bp += gh_sin * (m * r_P)
+            Br -= gh_cos * ((n + 1) * r_P)
+
+            if sv:
+                dgh_cos = g_sv[gidx] * cos_m + h_sv[gidx] * sin_m
+                dgh_sin = g_sv[gidx] * sin_m - h_sv[gidx] * cos_m
+
+                dBt -= dgh_cos * r_dP
+                if m > 0:
+                    dBp += dgh_sin * (m * r_P)
+                dBr -= dgh_cos * ((n + 1) * r_P)
+
+            pidx += 1
+
+    cos_phi = np.cos(magmath.deg2rad(geoc_lat))
+
+    mask = np.abs(cos_phi) < 1.0e-10
+    if np.any(mask):
+        # Apply calc_Bp_Pole where the mask is True, otherwise perform division
+        Bp = np.where(mask, Bp + magmath.calc_Bp_Pole(nmax, geoc_lat, sph, g, h), Bp / cos_phi)
+        if sv:
+            dBp = np.where(mask, dBp + magmath.calc_Bp_Pole(nmax, geoc_lat, sph, g_sv, h_sv), dBp / cos_phi)
+    else:
+        Bp /= cos_phi
+        if sv:
+            dBp /= cos_phi
+
+    if not sv:
+        return -Bt, Bp, Br, None, None, None
+
+    return -Bt, Bp, Br, -dBt, dBp, dBr
+
+
+def mag_SPH_summation_recursive(nmax: int, lon: np.ndarray, r: np.ndarray, geoc_lat: np.ndarray, g: np.ndarray,
+                                h: np.ndarray, g_sv: np.ndarray, h_sv: np.ndarray) -> Tuple:
+    """
+    Compute the magnetic elements (B_theta, B_phi, B_radius) and their secular variation like mag_SPH_summation_sv(),
+    without the tables of legendre functions and spherical harmonic terms. The legendre functions of each order m
+    are walked up over the degree with the recursion of geomaglib.legendre.Flattened_Chaos_Legendre1(), and the
+    radius power and cos_m(lon), sin_m(lon) are carried along, so only a few arrays of the number of points are
+    alive at once. The arithmetic is the same as the tables, so the results are identical.
+
+    :param nmax: max degree
+    :param lon: longitude in degree
+    :param r: the distance in km from the center of the Earth
+    :param geoc_lat: geocentric latitude in degree
+    :param g: g coefficients
+    :param h: h coefficients
+    :param g_sv: g secular variation coefficients
+    :param h_sv: h secular variation coefficients
+    :return: B_theta, B_phi, B_radius, dB_theta, dB_phi, dB_radius
+    """
+
+    geoc_lat = np.asarray(geoc_lat, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+
+    num_points = len(geoc_lat)
+    Bt, Bp, Br = np.zeros(num_points), np.zeros(num_points), np.zeros(num_points)
+    dBt, dBp, dBr = np.zeros(num_points), np.zeros(num_points), np.zeros(num_points)
+
+    colat = 90.0 - geoc_lat
+    if np.isclose(0, min(colat), POLE_EPSILON) or np.isclose(max(colat), 180, POLE_EPSILON):
+        warnings.warn(f'Input coordinates include the poles. They have been shifted by {POLE_EPSILON}')
+        mask = np.isclose(colat, 0, atol=POLE_EPSILON) | np.isclose(colat, 180, atol=POLE_EPSILON)
+        colat[mask] = POLE_EPSILON
+
+    costh = np.cos(np.radians(colat))
+    sinth = np.sqrt(1 - costh * costh)
+    rootn = np.sqrt(np.arange(2 * nmax ** 2 + 1))
+
+    a_over_r = EARTH_RADIUS / r
+    rel_radius_base = a_over_r ** 2
+    cos_lon = np.cos(np.radians(lon))
+    sin_lon = np.sin(np.radians(lon))
+
+    # P and dP of the diagonal (m, m), starting from (0, 0)
+    P_diag, dP_diag = np.ones(num_points), np.zeros(num_points)
+    cos_m, sin_m = 1.0, 0.0
+
+    for m in range(nmax + 1):
+        if m == 1:
+            cos_m, sin_m = cos_lon, sin_lon
+            P_diag, dP_diag = sinth, costh
+        elif m > 1:
+            cos_m, sin_m = cos_m * cos_lon - sin_m * sin_lon, cos_m * sin_lon + sin_m * cos_lon
+
+        # (a/r) ^ (m+2)
+        rel_radius = rel_radius_base
+        for _ in range(m):
+            rel_radius = rel_radius * a_over_r
+
+        P_prev, P_curr, dP_curr = None, P_diag, dP_diag
+        for n in range(m, nmax + 1):
+            if n == m + 1:
+                c2 = rootn[m + m + 1]
+                P_tmp = c2 * P_diag
+                P_prev, P_curr, dP_curr = P_diag, costh * P_tmp, dP_diag * costh * c2 - sinth * P_tmp
+                if m > 0:
+                    # the diagonal of the next order
+                    next_diag = (sinth * P_tmp / rootn[m + m + 2], P_curr * rootn[m + 1] * np.sqrt(0.5))
+            elif n > m + 1:
+                d = n * n - m * m
+                e = n + n - 1
+                P_next = (e * costh * P_curr - rootn[d - e] * P_prev) / rootn[d]
+                P_prev, P_curr = P_curr, P_next
+                dP_curr = (n * costh * P_curr - rootn[d] * P_prev) / sinth
+
+            if n > m:
+                rel_radius = rel_radius * a_over_r
+            if n == 0:
+                continue
+
+            gidx = n * (n + 1) // 2 + m
+
+            r_dP = rel_radius * dP_curr
+            r_P = rel_radius * P_curr
+
+            gh_cos = g[gidx] * cos_m + h[gidx] * sin_m
+            gh_sin = g[gidx] * sin_m - h[gidx] * cos_m
+            dgh_cos = g_sv[gidx] * cos_m + h_sv[gidx] * sin_m
+            dgh_sin = g_sv[gidx] * sin_m - h_sv[gidx] * cos_m
+
+            Bt -= gh_cos * r_dP
+            dBt -= dgh_cos * r_dP
+
+            if m > 0:
+                Bp += gh_sin * (m * r_P)
+                dBp += dgh_sin * (m * r_P)
+
+            Br -= gh_cos * ((n + 1) * r_P)
+            dBr -= dgh_cos * ((n + 1) * r_P)
+
+        if m > 0 and m < nmax:
+            P_diag, dP_diag = next_diag
+
+    cos_phi = np.cos(magmath.deg2rad(geoc_lat))
+
+    mask = np.abs(cos_phi) < 1.0e-10
+    if np.any(mask):
+        # only the points at the poles need the spherical harmonic terms
+        sph = sh_vars.comp_sh_vars(lon[mask], r[mask], geoc_lat[mask], nmax)
+        Bp[~mask] /= cos_phi[~mask]
+        dBp[~mask] /= cos_phi[~mask]
+        Bp[mask] += magmath.calc_Bp_Pole(nmax, geoc_lat[mask], sph, g, h)
+        dBp[mask] += magmath.calc_Bp_Pole(nmax, geoc_lat[mask], sph, g_sv, h_sv)
+    else:
+        Bp /= cos_phi
+        dBp /= cos_phi
+
+    return -Bt, Bp, Br, -dBt, dBp, dBr
+
+
+def rotate_magvec_sv(Bt: np.ndarray, Bp: np.ndarray, Br: np.ndarray, dBt: np.ndarray, dBp: np.ndarray,
+                     dBr: np.ndarray, geoc_lat: np.ndarray, geod_lat: np.ndarray) -> Tuple:
+    """
+    Convert the magnetic vector and its secular variation from spherical to geodetic with the same rotation.
+
+    :param Bt: magnetic elements theta
+    :param Bp: magnetic elements phi
+    :param Br: magnetic elements radius
+    :param dBt: secular variation of magnetic elements theta
+    :param dBp: secular variation of magnetic elements phi
+    :param dBr: secular variation of magnetic elements radius
+    :param geoc_lat: geocentric latitude
+    :param geod_lat: geodetic latitude
+    :return: Bx, By, Bz, dBx, dBy, dBz in geodetic. dBx, dBy and dBz are None if dBt is None.
+    """
+
+    psi = (math.pi / 180.0) * (geoc_lat - geod_lat)
+    sin_psi = np.sin(psi)
+    cos_psi = np.cos(psi)
+
+    Bz = Bt * sin_psi + Br * cos_psi
+    Bx = Bt * cos_psi - Br * sin_psi
+    if dBt is None:
+        return Bx, Bp, Bz, None, None, None
+    dBz = dBt * sin_psi + dBr * cos_psi
+    dBx = dBt * cos_psi - dBr * sin_psi
+
+    return Bx, Bp, Bz, dBx, dBp, dBz
+
+
+def grid_SPH_summation_sv(nmax: int, rel_radius: list, cos_mlon: list, sin_mlon: list, Leg: list,
+                          geoc_lat: np.ndarray, g: np.ndarray, h: np.ndarray, g_sv: np.ndarray,
+                          h_sv: np.ndarray) -> Tuple:
+    """
+    Compute the magnetic elements (B_theta, B_phi, B_radius) and their secular variation on a separable grid. The
+    radius power and legendre terms depend only on the rows (latitude and altitude) and cos_m(lon) and sin_m(lon)
+    only on the columns (longitude). The terms of each order m are summed over the degrees for every row first, and
+    then combined with the longitude terms by matrix products.
+
+    :param nmax: max degree
+    :param rel_radius: (a/r) ^ (n+2) of the rows for n from 0 to nmax
+    :param cos_mlon: cos_m(lon) of the columns for m from 0 to nmax
+    :param sin_mlon: sin_m(lon) of the columns for m from 0 to nmax
+    :param Leg: legendre function array of the rows. Leg[0] for Plm array; Leg[1] for dPlm array.
+    :param geoc_lat: geocentric latitude in degree of the rows
+    :param g: g coefficients
+    :param h: h coefficients
+    :param g_sv: g secular variation coefficients
+    :param h_sv: h secular variation coefficients
+    :return: B_theta, B_phi, B_radius, dB_theta, dB_phi, dB_radius in (number of rows, number of columns) arrays
+    """
+
+    num_rows = len(geoc_lat)
+    num_cols = len(cos_mlon[1]) if nmax > 0 else 1
+
+    coefs = np.stack([g, h, g_sv, h_sv])
+
+    # the sums over degree of each order for the rows. The last axis is for g, h, g_sv and h_sv
+    sum_dP = np.zeros((nmax + 1, num_rows, 4))
+    sum_mP = np.zeros((nmax + 1, num_rows, 4))
+    sum_nP = np.zeros((nmax + 1, num_rows, 4))
+
+    legP = Leg[0]
+    legdP = Leg[1]
+
+    pidx = 1
+
+    for m in range(nmax + 1):
+        for n in range(m, nmax + 1):
+            if n == 0:
+                continue
+            gidx = n * (n + 1) // 2 + m
+
+            r_dP = rel_radius[n] * legdP[pidx]
+            r_P = rel_radius[n] * legP[pidx]
+
+            sum_dP[m] += r_dP[:, None] * coefs[:, gidx]
+            sum_mP[m] += (m * r_P)[:, None] * coefs[:, gidx]
+            sum_nP[m] += ((n + 1) * r_P)[:, None] * coefs[:, gidx]
+
+            pidx += 1
+
+    cos_cols = np.array([np.broadcast_to(cos_mlon[m], (num_cols,)) for m in range(nmax + 1)])
+    sin_cols = np.array([np.broadcast_to(sin_mlon[m], (num_cols,)) for m in range(nmax + 1)])
+
+    fields = []
+    for g_col, h_col in [(0, 1), (2, 3)]:
+        # (rows, m) @ (m, cols)
+        Bt = sum_dP[:, :, g_col].T @ cos_cols + sum_dP[:, :, h_col].T @ sin_cols
+        Bp = sum_mP[:, :, g_col].T @ sin_cols - sum_mP[:, :, h_col].T @ cos_cols
+        Br = -(sum_nP[:, :, g_col].T @ cos_cols + sum_nP[:, :, h_col].T @ sin_cols)
+        fields.append([Bt, Bp, Br])
+
+    cos_phi = np.cos(magmath.deg2rad(geoc_lat))
+    mask = np.abs(cos_phi) < 1.0e-10
+
+    for Bt, Bp, Br in fields:
+        Bp[~mask] /= cos_phi[~mask, None]
+
+    for row in np.flatnonzero(mask):
+        # calc_Bp_Pole needs the spherical harmonic terms of every point in the row
+        sph = {
+            "relative_radius_power": [np.full(num_cols, rel_radius[n][row]) for n in range(nmax + 1)],
+            "cos_mlon": list(cos_cols),
+            "sin_mlon": list(sin_cols),
+        }
+        row_lat = np.full(num_cols, geoc_lat[row])
+        fields[0][1][row] += magmath.calc_Bp_Pole(nmax, row_lat, sph, g, h)
+        fields[1][1][row] += magmath.calc_Bp_Pole(nmax, row_lat, sph, g_sv, h_sv)
+
+    return tuple(fields[0] + fields[1])
@@ -34,3 +34,23 @@ def to_npIntarr(num: Union[float, list, tuple]) -> np.ndarray:
 
 
 
+
+def iso_to_dyear(dates: Union[str, list, tuple, np.ndarray]) -> np.ndarray:
+    '''
+    Convert the ISO 8601 dates like "2026-03-01" or "2026-03-01T12:30:00" to decimal years with the same rule as
+    geomaglib.util.calc_dec_year()
+
+    :param dates: The str, list or tuple type of ISO dates
+    :return: numpy array of decimal years
+    '''
+
+    try:
+        times = np.array(dates, dtype="datetime64[s]")
+    except ValueError as err:
+        raise ValueError(f"Input dates are not ISO 8601 dates. {err}")
+
+    years = times.astype("datetime64[Y]")
+    year_start = years.astype("datetime64[s]")
+    year_len = (years + 1).astype("datetime64[s]") - year_start
+
+    return (years.astype(np.int64) + 1970) + (times - year_start) / year_len